@@ -1,52 +1,20 @@
-import numpy as np
 import os
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import guicontroller  # Assuming this is defined elsewhere in your code
+import analysiscache
+import bands
+from analysiscore import (amplitude_to_db, calculate_highest_resonant_frequency, resonant_frequency_from_spectrum,
+                          clamp_resonant_frequency, stream_resonant_frequency)
+
+# The analysis functions live in analysiscore (and are re-exported here), and the GUI
+# modules (guicontroller, plotsurface and the Tk canvas backend) are only imported inside
+# the plot functions, so importing this module needs neither matplotlib nor a display
 
 # Define a global variable to track the current plot state
 current_plot_state = 0
 
-# Function to convert amplitude to decibels (dB)
-def amplitude_to_db(amplitude):
-    return 20 * np.log10(np.abs(amplitude) + 1e-6)  # Small offset to avoid log(0)
-
-def calculate_highest_resonant_frequency(waveform, framerate):
-    # Perform the Fourier Transform
-    spectrum = np.fft.fft(waveform)
-
-    # Generate frequencies associated with the FFT result
-    freq = np.fft.fftfreq(len(spectrum), d=1 / framerate)
-
-    # Keep only the positive frequencies
-    positive_freqs = freq[:len(freq)//2]
-
-    # Calculate magnitude (absolute value) of the spectrum
-    magnitude = np.abs(spectrum[:len(spectrum)//2])
-
-    # Set the DC component (zero frequency) magnitude to zero to avoid the peak at 0 Hz
-    magnitude[0] = 0
-
-    # Debugging: Check for the maximum magnitude value and its corresponding frequency
-    max_magnitude = np.max(magnitude)
-    peak_index = np.argmax(magnitude)
-    highest_resonant_frequency = positive_freqs[peak_index]
-
-    # Ensure the resonant frequency is within the Nyquist limit
-    nyquist_limit = framerate / 2
-    if highest_resonant_frequency > nyquist_limit:
-        print(f"Warning: Calculated resonant frequency {highest_resonant_frequency} Hz is above the Nyquist limit of {nyquist_limit} Hz.")
-        highest_resonant_frequency = nyquist_limit  # Clamp to Nyquist limit
-
-    # Clamp if the frequency is too close to Nyquist
-    if highest_resonant_frequency > nyquist_limit - 100:
-        print(f"Warning: Resonant frequency is too close to Nyquist limit. Clamping to {nyquist_limit - 100} Hz.")
-        highest_resonant_frequency = nyquist_limit - 100  # Force it to be 100 Hz below Nyquist
-
-    return highest_resonant_frequency
-
-
+# Plots the waveform, the analysis runs in the background and the plot is drawn when it is ready
 def plot_waveform(file_path):
+    import guicontroller
+
     # Verifies the file path
     if not file_path or file_path is None:
         return
@@ -54,167 +22,128 @@ def plot_waveform(file_path):
     if not os.path.exists(file_path):
         return
 
-    with guicontroller.wave.open(file_path, 'rb') as wav_file:
-        params = wav_file.getparams()
-        n_channels, sampwidth, framerate, n_frames, comptype, compname = params[:6]
+    guicontroller.scheduler.submit('plot', prepare_waveform, file_path,
+                                   on_done=draw_waveform, on_error=guicontroller.show_error)
+
+
+# Runs on a worker thread: decodes the file and computes what the waveform plot needs
+def prepare_waveform(task, file_path):
+    task.progress(None, "Loading audio")
+    analysis = analysiscache.get_analysis(file_path, task.progress)
+    task.progress(None, "Computing spectrum")
+    analysis.spectrum(progress=task.progress)
+    analysis.peak_frequency()
+    task.progress(None, "Preparing waveform")
+    analysis.waveform_pyramid()
+    return analysis
+
+
+# Runs on the main thread once prepare_waveform has finished
+def draw_waveform(analysis):
+    import guicontroller
+    import plotsurface
+
+    # Calculations needed (already cached by prepare_waveform)
+    duration = analysis.duration
+    highest_resonant_frequency = clamp_resonant_frequency(analysis.peak_frequency(), analysis.framerate)
 
-        # Calculations needed
-        duration = n_frames / float(framerate)
-        frames = wav_file.readframes(n_frames)
-        waveform = np.frombuffer(frames, dtype=np.int16)
-        highest_resonant_frequency = calculate_highest_resonant_frequency(waveform, framerate)
+    # Updates the controller info
+    guicontroller.duration_label.config(
+        text=f"Duration: {duration:.2f} seconds\nHighest Resonant Frequency: {highest_resonant_frequency:.2f} Hz"
+    )
 
-        # Creates the time axis
-        time_axis = np.linspace(0, n_frames / framerate, num=n_frames)
+    # Store the original duration and Highest Resonant Frequency values
+    guicontroller.original_duration_text = guicontroller.duration_label.cget("text")
 
-        # Changes the size of the graph/figure
-        fig = Figure(figsize=(6, 4))  # Adjusted size to fit canvas
+    show_view('waveform', plotsurface.WaveformView, analysis)
 
-        # All the axis / the way the graph looks
-        ax = fig.add_subplot(111)
-        ax.plot(time_axis, waveform)
-        ax.set_title("Waveform")
-        ax.set_xlabel("Time (s)")
-        ax.set_ylabel("Amplitude")
-        ax.margins(x=0.05, y=0.05)  # Margins to avoid cutting off values
-        ax.set_xlim([0, np.max(time_axis)])  # Set fixed x-axis limits
-        ax.set_ylim([np.min(waveform), np.max(waveform)])  # Set fixed y-axis limits
-        fig.tight_layout(pad=2)  # Ensure tight layout to fit canvas
 
-        # Updates the controller info
-        guicontroller.duration_label.config(
-            text=f"Duration: {duration:.2f} seconds\nHighest Resonant Frequency: {highest_resonant_frequency:.2f} Hz"
-        )
+# Builds the waveform figure, this needs no GUI so it can also be rendered headless
+def waveform_figure(analysis):
+    import plotsurface
+    return plotsurface.view_figure(plotsurface.WaveformView, analysis)
 
-        # Store the original duration and Highest Resonant Frequency values
-        guicontroller.original_duration_text = guicontroller.duration_label.cget("text")
 
-        # Clear the canvas
-        for child in guicontroller.plot_canvas.winfo_children():
-            child.destroy()
+# Shows a view on the plot canvas, which is created once and then reused for every plot
+# (see plotsurface.PlotSurface)
+def show_view(name, view_class, *args, **view_options):
+    import guicontroller
+    import plotsurface
 
-        # Attach the plot to the canvas
-        canvas = FigureCanvasTkAgg(fig, master=guicontroller.plot_canvas)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
+    if guicontroller.plot_surface is None:
+        guicontroller.plot_surface = plotsurface.PlotSurface(guicontroller.plot_canvas)
+    guicontroller.plot_surface.show(name, view_class, *args, **view_options)
+    guicontroller.show_timings()
 
 
 # The time series Graph Data/Instructions
 # Each dot is the dominant/peak of frequency on each of them
 def plot_timeseries(file_path, plot_type):
+    import guicontroller
+
     if not file_path or file_path is None:
         return
 
     if not os.path.exists(file_path):
         return
 
-    with guicontroller.wave.open(file_path, 'rb') as wav_file:
-        params = wav_file.getparams()
-        n_channels, sampwidth, framerate, n_frames, comptype, compname = params[:6]
-        frames = wav_file.readframes(n_frames)
-        waveform = np.frombuffer(frames, dtype=np.int16)
-
-        # Create the time axis for time-domain plot
-        time_axis = np.linspace(0, n_frames / framerate, num=n_frames)
-
-        if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high':
-            # This is the frequency-domain plot
-            # Perform FFT to get the frequency spectrum
-            fft_spectrum = np.fft.fft(waveform)
-            freq = np.fft.fftfreq(len(fft_spectrum), d=1 / framerate)
-            amplitude_spectrum = np.abs(fft_spectrum)
-            amplitude_spectrum_db = amplitude_to_db(amplitude_spectrum)
-
-            # Define frequency ranges for low, mid, and high plots
-            if plot_type == 'low':
-                freq_range = (5, 300)  # Low frequency range
-                title = "Low Frequency"
-                color = 'green'
-            elif plot_type == 'mid':
-                freq_range = (300, 2000)  # Mid frequency range
-                title = "Mid Frequency"
-                color = 'yellow'
-            elif plot_type == 'high':
-                freq_range = (2000, np.max(freq))  # High frequency range
-                title = "High Frequency"
-                color = 'red'
-
-            # Mask the spectrum to the chosen frequency range
-            mask = (freq >= freq_range[0]) & (freq <= freq_range[1])
-            filtered_freq = freq[mask]
-            filtered_amplitude_db = amplitude_spectrum_db[mask]
-
-            # Convert frequency to time: Time (t) = 1 / Frequency (f)
-            # We will plot the frequency axis as time-related data
-            time_related_axis = 1 / filtered_freq  # Convert frequency to time axis
-
-            # Create the frequency-domain plot (FFT) with time on the x-axis
-            fig = Figure(figsize=(6, 4))
-            ax = fig.add_subplot(111)
-            ax.plot(time_related_axis, filtered_amplitude_db, color='blue') # Frequency spectrum line
-            ax.set_title(title)
-            ax.set_xlabel("Time (s)")  # Time on x-axis (converted from frequency)
-            ax.set_ylabel("Power (dB)")  # Power in dB on y-axis
-            ax.grid(True)
-
-            # Find the peak values for each frequency range and plot them
-            peak_index = np.argmax(filtered_amplitude_db)
-            peak_freq = filtered_freq[peak_index]
-            peak_value = filtered_amplitude_db[peak_index]
-
-            # Plot a dot at the highest value within the frequency range
-            ax.scatter(1 / peak_freq, peak_value, color=color, s=100, label=f"Peak {plot_type}")
-
-            fig.tight_layout(pad=2)
-
-        else:
-            # This is the time-domain plot (original waveform)
-            fig = Figure(figsize=(6, 4))
-            ax = fig.add_subplot(111)
-            ax.plot(time_axis, waveform, color='black')  # Time-domain plot
-            ax.set_title("Waveform")
-            ax.set_xlabel("Time (s)")  # Time on x-axis in seconds
-            ax.set_ylabel("Amplitude")  # Amplitude on y-axis
-            ax.grid(True)
-
-            fig.tight_layout(pad=2)
-
-        # Clear the canvas and attach the plot
-        for child in guicontroller.plot_canvas.winfo_children():
-            child.destroy()
-
-        canvas = FigureCanvasTkAgg(fig, master=guicontroller.plot_canvas)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
-
-
-
+    guicontroller.scheduler.submit('plot', prepare_timeseries, file_path, plot_type,
+                                   on_done=draw_timeseries, on_error=guicontroller.show_error)
+
+
+# Runs on a worker thread: computes the spectrum and band peaks (or the waveform pyramid)
+def prepare_timeseries(task, file_path, plot_type):
+    task.progress(None, "Loading audio")
+    analysis = analysiscache.get_analysis(file_path, task.progress)
+    if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high' or plot_type == 'all':
+        task.progress(None, "Computing spectrum")
+        analysis.spectrum(progress=task.progress)
+        analysis.spectrum_db()
+        analysis.band_peaks()
+    else:
+        task.progress(None, "Preparing waveform")
+        analysis.waveform_pyramid()
+    return analysis, plot_type
+
+
+# Runs on the main thread once prepare_timeseries has finished
+def draw_timeseries(result):
+    import plotsurface
+    analysis, plot_type = result
+    if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high':
+        # This is the frequency-domain plot, one view is reused for all bands
+        show_view('spectrum', plotsurface.SpectrumView, analysis, plot_type)
+    else:
+        # This is the time-domain plot (original waveform)
+        show_view('waveform_grid', plotsurface.WaveformView, analysis, color='black', grid=True)
+
+
+# Builds the low/mid/high spectrum or waveform figure, needs no GUI
+def timeseries_figure(analysis, plot_type):
+    import plotsurface
+    if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high':
+        return plotsurface.view_figure(plotsurface.SpectrumView, analysis, plot_type)
+    return plotsurface.view_figure(plotsurface.WaveformView, analysis, color='black', grid=True)
 
 
 # Allows the plots to be in the same location as the previous one
 def swap_frequency_plot():
     global current_plot_state
+    import guicontroller
     file_path = guicontroller.selected_file_path
-    if current_plot_state == 0:
-        plot_timeseries(file_path, 'low')
-    elif current_plot_state == 1:
-        plot_timeseries(file_path, 'mid')
-    elif current_plot_state == 2:
-        plot_timeseries(file_path, 'high')
+    band_names = list(bands.get_band_set())
+    plot_timeseries(file_path, band_names[current_plot_state % len(band_names)])
 
-    current_plot_state = (current_plot_state + 1) % 3  # Cycle through 0, 1, 2 for the low, medium, and high freq
+    current_plot_state = (current_plot_state + 1) % len(band_names)  # Cycle through the low, medium, and high freq
 
 
 # Updates the plot button
 def update_plot_button():
+    import guicontroller
     guicontroller.plot_button.config(command=lambda: plot_waveform(guicontroller.selected_file_path))
 
 
 # Updates the swap button
 def update_swap_button():
+    import guicontroller
     guicontroller.three_plot_button.config(command=swap_frequency_plot)
-
-
-# Delays the update slightly
-guicontroller.root.after(100, update_plot_button)
-guicontroller.root.after(100, update_swap_button)
\ No newline at end of file
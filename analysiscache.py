@@ -0,0 +1,382 @@
+### This file holds the analysis cache. Each audio file is decoded once and
+### its derived data (spectrum, band peaks, STFT) is computed on first use and
+### kept in memory, so switching between plots does not redo any work.
+
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+import numpy as np
+import analysiscore
+import analysisindex
+import bands
+import decode
+import decimation
+import profiling
+import reverb
+import spectral
+import wavreader
+
+# Default memory budget for all cached analyses
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+# Most columns kept for a heatmap, far more than the canvas can show,
+# so long files stay bounded in memory
+MAX_HEATMAP_COLUMNS = 4096
+
+# Names of the stored artifacts that depend on the sample scale, renamed whenever it changes so
+# values stored by an older version are recomputed instead of mixed with new ones
+SPECTRUM_ARTIFACT = 'spectrum_v4'
+SUMMARY_ARTIFACT = 'summary_v4'
+PYRAMID_ARTIFACT = 'pyramid_v2'
+STFT_ARTIFACT = 'stft_v2'
+
+
+# Builds the cache key for a file: its path plus modification time and size,
+# so an edited or replaced file is treated as a new one
+def file_identity(file_path):
+    stat = os.stat(file_path)
+    return os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size
+
+
+# Holds the decoded samples of one file and lazily computes derived data
+class AudioAnalysis:
+    # dtype is the precision of the derived data (np.float32 or np.float64)
+    def __init__(self, waveform, framerate, file_path=None, owner=None, n_channels=1, sampwidth=2,
+                 artifacts=None, dtype=spectral.DEFAULT_DTYPE):
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        self._owner = owner
+        # Persistent store (analysisindex.FileArtifacts) of derived data, or None
+        self._artifacts = artifacts
+        self._peak_frequency = None
+        self._spectrum = None
+        self._spectrum_db = None
+        self._band_peaks = None
+        self._band_set_peaks = {}
+        self._band_energies = {}
+        self._decay_times = {}
+        self._stft = {}
+        self._pyramid = None
+        # Derived data may be requested from several worker threads at once
+        self._lock = threading.RLock()
+
+        self.waveform = waveform
+        self.framerate = framerate
+        self.n_channels = n_channels
+        self.sampwidth = sampwidth
+        self.n_frames = len(waveform)
+        self.duration = self.n_frames / float(framerate)
+
+    # Builds the analysis of a file on disk without ever writing a converted copy
+    # Mono 16-bit WAV samples stay memory-mapped so only the pages that are used get read,
+    # other WAVs are downmixed as the analysis reads them (see wavreader.MonoView), other
+    # formats are decoded by decode.decode_file (or memory-mapped from its cache if decoded before)
+    # Derived data is loaded from / saved to the given analysisindex.AnalysisIndex if one is passed
+    # progress, if given, is called with (fraction done, message) while the file is hashed and
+    # decoded, and may raise (see tasks.Task.progress) to stop a load that is no longer needed
+    @classmethod
+    def from_file(cls, file_path, owner=None, index=None, dtype=spectral.DEFAULT_DTYPE, progress=None):
+        def report(message):
+            return None if progress is None else lambda fraction: progress(fraction, message)
+
+        artifacts = None
+        if index is not None:
+            # Hashes the whole file unless the index has seen it unchanged before
+            with profiling.stage('decode.hash'):
+                artifacts = index.for_file(file_path, report("Reading audio"))
+        if file_path.lower().endswith(".wav"):
+            with profiling.stage('decode.wav'):
+                reader = wavreader.WavReader(file_path)
+                waveform = reader.mono()
+            return cls(waveform, reader.framerate, file_path, owner,
+                       reader.n_channels, reader.sampwidth, artifacts, dtype)
+        samples, framerate, n_channels = decode.decode_file(file_path, index, progress=report("Decoding audio"))
+        return cls(samples, framerate, file_path, owner, n_channels, samples.dtype.itemsize, artifacts, dtype)
+
+    # Loads a stored artifact from the persistent index, None if missing or there is no index
+    def _load(self, name):
+        if self._artifacts is None:
+            return None
+        try:
+            with profiling.stage('index.load', artifact=name):
+                return self._artifacts.load(name)
+        except (sqlite3.Error, OSError, ValueError) as error:
+            print(f"Warning: could not load '{name}' from the analysis index ({error})")
+            return None
+
+    # Saves an artifact to the persistent index, if there is one
+    def _save(self, name, **arrays):
+        if self._artifacts is None:
+            return
+        try:
+            with profiling.stage('index.save', artifact=name):
+                self._artifacts.save(name, **arrays)
+        except (sqlite3.Error, OSError) as error:
+            print(f"Warning: could not save '{name}' to the analysis index ({error})")
+
+    # Writes the mono samples to a WAV file, only done when explicitly requested
+    def export_wav(self, file_path):
+        wavreader.write_wav(file_path, self.waveform, self.framerate)
+
+    # Min/max pyramid of the waveform used to draw it at any zoom level
+    def waveform_pyramid(self):
+        with self._lock:
+            if self._pyramid is None:
+                stored = self._load(PYRAMID_ARTIFACT)
+                if stored is not None:
+                    self._pyramid = decimation.MinMaxPyramid.from_arrays(self.waveform, self.framerate, stored)
+                else:
+                    with profiling.stage('pyramid'):
+                        self._pyramid = decimation.MinMaxPyramid(self.waveform, self.framerate)
+                    self._save(PYRAMID_ARTIFACT, **self._pyramid.to_arrays())
+                self._changed()
+            return self._pyramid
+
+    # Positive frequency spectrum of the whole file as (freq, magnitude), averaged over segments
+    # (Welch's method, see spectral.WelchSpectrum) for files of every length, so the dB values of
+    # tones and of broadband noise alike do not depend on how long a recording is
+    # The blocks are read one at a time, so memory stays constant for long recordings
+    # progress, if given, is called with (fraction done, message) after every block,
+    # the message reports the resonant frequency found so far
+    def spectrum(self, progress=None):
+        with self._lock:
+            if self._spectrum is None:
+                stored = self._load(SPECTRUM_ARTIFACT)
+                if stored is not None:
+                    # Stored as float32 dB, the magnitude is recovered from it
+                    freq = np.fft.rfftfreq(int(stored['n_fft']), d=1 / self.framerate)
+                    self._spectrum_db = stored['db']
+                    self._spectrum = (freq, 10 ** (self._spectrum_db.astype(self.dtype) / 20))
+                else:
+                    with profiling.stage('fft', method='welch', frames=self.n_frames):
+                        welch = spectral.WelchSpectrum(self.framerate, dtype=self.dtype)
+                        blocks = (self.waveform[start:start + wavreader.DEFAULT_CHUNK_FRAMES]
+                                  for start in range(0, self.n_frames, wavreader.DEFAULT_CHUNK_FRAMES))
+                        for seconds, resonant_frequency, _ in analysiscore.stream_resonant_frequency(
+                                blocks, self.framerate, welch=welch):
+                            if progress is not None:
+                                progress(min(1.0, seconds / self.duration),
+                                         f"Analyzing, resonant frequency so far {resonant_frequency:.0f} Hz")
+                        self._spectrum = welch.spectrum()
+                    self._save(SPECTRUM_ARTIFACT, n_fft=welch.segment_size, db=self.spectrum_db().astype(np.float32))
+                self._changed()
+            return self._spectrum
+
+    # Spectrum magnitude in decibels
+    def spectrum_db(self):
+        with self._lock:
+            if self._spectrum_db is None:
+                freq, magnitude = self.spectrum()
+                with profiling.stage('amplitude_to_db'):
+                    self._spectrum_db = 20 * np.log10(magnitude + 1e-6)
+                self._changed()
+            return self._spectrum_db
+
+    # Loads or computes the small per-file summary: peak frequency and band peaks
+    def _summary(self):
+        stored = self._load(SUMMARY_ARTIFACT)
+        if stored is not None:
+            self._peak_frequency = float(stored['peak_frequency'])
+            self._band_peaks = {str(name): tuple(peak) for name, peak in zip(stored['band_names'], stored['band_peaks'])}
+            return
+        freq, magnitude = self.spectrum()
+        spectrum_db = self.spectrum_db()
+        with profiling.stage('band_peaks'):
+            self._peak_frequency = spectral.peak_frequency(freq, magnitude)
+            self._band_peaks = bands.band_peaks(freq, spectrum_db)
+        self._save(SUMMARY_ARTIFACT, peak_frequency=self._peak_frequency,
+                   band_names=np.array(list(self._band_peaks)),
+                   band_peaks=np.array(list(self._band_peaks.values()), dtype=np.float64))
+
+    # Frequency of the largest spectrum peak (excluding 0 Hz)
+    def peak_frequency(self):
+        with self._lock:
+            if self._peak_frequency is None:
+                self._summary()
+            return self._peak_frequency
+
+    # Peak (frequency, dB value) of each band of a registered band set (see bands.BAND_SETS),
+    # by default the low/mid/high bands
+    def band_peaks(self, band_set=bands.DEFAULT_BAND_SET):
+        with self._lock:
+            if band_set == bands.DEFAULT_BAND_SET:
+                if self._band_peaks is None:
+                    self._summary()
+                return self._band_peaks
+            if band_set not in self._band_set_peaks:
+                freq, _ = self.spectrum()
+                spectrum_db = self.spectrum_db()
+                with profiling.stage('band_peaks', band_set=band_set):
+                    self._band_set_peaks[band_set] = bands.band_peaks(freq, spectrum_db, band_set)
+            return self._band_set_peaks[band_set]
+
+    # Energy (sum of squared magnitudes) of each band of a registered band set
+    def band_energies(self, band_set=bands.DEFAULT_BAND_SET):
+        with self._lock:
+            if band_set not in self._band_energies:
+                freq, magnitude = self.spectrum()
+                with profiling.stage('band_energies', band_set=band_set):
+                    self._band_energies[band_set] = bands.band_energies(freq, magnitude, band_set)
+            return self._band_energies[band_set]
+
+    # Reverberation times {band: {'edt', 'rt20', 'rt30', 'rt60'}} of each band of a band set
+    def decay_times(self, band_set=bands.DEFAULT_BAND_SET, progress=None):
+        name = f"reverb_{band_set}"
+        with self._lock:
+            if band_set not in self._decay_times:
+                stored = self._load(name)
+                if stored is not None:
+                    self._decay_times[band_set] = {
+                        str(band): dict(zip(reverb.DECAY_FIELDS, map(float, values)))
+                        for band, values in zip(stored['band_names'], stored['values'])}
+                else:
+                    with profiling.stage('reverb', band_set=band_set):
+                        times = reverb.decay_times(self.waveform, self.framerate, band_set, progress=progress)
+                    self._decay_times[band_set] = times
+                    self._save(name, band_names=np.array(list(times)),
+                               values=np.array([[band[field] for field in reverb.DECAY_FIELDS]
+                                                for band in times.values()], dtype=np.float64))
+            return self._decay_times[band_set]
+
+    # Magnitude STFT in decibels as (freq, time, heatmap_db)
+    def stft(self, window_size=spectral.DEFAULT_WINDOW_SIZE, hop_size=spectral.DEFAULT_HOP_SIZE, progress=None):
+        key = (window_size, hop_size)
+        name = f"{STFT_ARTIFACT}_{window_size}_{hop_size}"
+        with self._lock:
+            if key not in self._stft:
+                stored = self._load(name)
+                if stored is not None:
+                    self._stft[key] = (stored['freq'], stored['time'], stored['heatmap_db'])
+                else:
+                    with profiling.stage('stft', window_size=window_size, hop_size=hop_size):
+                        freq, time, heatmap = spectral.stft(self.waveform, self.framerate, window_size, hop_size,
+                                                            dtype=self.dtype, max_columns=MAX_HEATMAP_COLUMNS,
+                                                            progress=progress)
+                        self._stft[key] = (freq, time, spectral.magnitude_to_db(heatmap).astype(np.float32))
+                    self._save(name, freq=freq, time=time, heatmap_db=self._stft[key][2])
+                self._changed()
+            return self._stft[key]
+
+    # Approximate memory held by this analysis in bytes
+    def nbytes(self):
+        # Memory-mapped samples live in the page cache and are not counted, nor are samples
+        # that are only downmixed when read
+        total = 0 if isinstance(self.waveform, (np.memmap, wavreader.MonoView)) else self.waveform.nbytes
+        if self._spectrum is not None:
+            total += sum(array.nbytes for array in self._spectrum)
+        if self._spectrum_db is not None:
+            total += self._spectrum_db.nbytes
+        if self._pyramid is not None:
+            total += self._pyramid.nbytes()
+        for arrays in self._stft.values():
+            total += sum(array.nbytes for array in arrays)
+        return total
+
+    # Lets the owning cache re-check its memory budget after new data is computed
+    def _changed(self):
+        if self._owner is not None:
+            self._owner.trim()
+
+
+# How often (s) a thread waiting for another thread's load of the same file checks for cancellation
+WAIT_POLL_SECONDS = 0.2
+
+
+# Least recently used cache of AudioAnalysis objects with a memory budget
+# The lock only guards the entries, files are loaded outside it so a slow decode never holds
+# up analyses of files that are already loaded
+class AnalysisCache:
+    # With use_default_index the shared analysisindex.default_index() is opened on first use
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, index=None, use_default_index=False,
+                 dtype=spectral.DEFAULT_DTYPE):
+        self.max_bytes = max_bytes
+        self.dtype = dtype
+        self.index = index
+        self.use_default_index = use_default_index
+        self._entries = OrderedDict()
+        # Futures of the files being loaded, so a file requested twice is only loaded once
+        self._loading = {}
+        self._lock = threading.RLock()
+
+    # Returns the analysis for a file, decoding it only on the first request
+    # progress is passed on to AudioAnalysis.from_file, and is also called while waiting for
+    # another thread that is loading the same file, so both waits can be cancelled
+    def get(self, file_path, progress=None):
+        key = file_identity(file_path)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry
+                future = self._loading.get(key)
+                if future is None:
+                    future = self._loading[key] = Future()
+                    if self.index is None and self.use_default_index:
+                        self.index = analysisindex.default_index()
+                    index = self.index
+                    break
+
+            # Another thread is loading the file, if its load fails (or is cancelled) this one retries
+            while not future.done():
+                if progress is not None:
+                    progress(None, "Loading audio")
+                wait([future], timeout=WAIT_POLL_SECONDS)
+            if future.exception() is None:
+                return future.result()
+
+        try:
+            entry = AudioAnalysis.from_file(file_path, owner=self, index=index, dtype=self.dtype, progress=progress)
+        except BaseException as error:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(error)
+            raise
+
+        with self._lock:
+            del self._loading[key]
+            # Drop any stale entry for an older version of the same file
+            for old_key in [k for k in self._entries if k[0] == key[0]]:
+                del self._entries[old_key]
+            self._entries[key] = entry
+            self.trim()
+        future.set_result(entry)
+        return entry
+
+    # Evicts the least recently used entries until the cache fits its budget,
+    # the most recent entry is always kept
+    def trim(self):
+        with self._lock:
+            while len(self._entries) > 1 and self.nbytes() > self.max_bytes:
+                self._entries.popitem(last=False)
+
+    def nbytes(self):
+        with self._lock:
+            return sum(entry.nbytes() for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Precision of the GUI analysis, SPIDAM_DTYPE=float32 selects the faster single precision pipeline
+# (visualization.py --float32 does the same)
+def dtype_from_environment():
+    name = os.environ.get("SPIDAM_DTYPE", "float64")
+    if name not in ("float32", "float64"):
+        print(f"Warning: unknown SPIDAM_DTYPE '{name}', using float64")
+        name = "float64"
+    return np.dtype(name)
+
+
+# Shared cache used by the GUI, backed by the persistent on-disk index
+cache = AnalysisCache(use_default_index=True, dtype=dtype_from_environment())
+
+
+def get_analysis(file_path, progress=None):
+    return cache.get(file_path, progress)
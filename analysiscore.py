@@ -0,0 +1,57 @@
+### This file holds the analysis core: the resonant frequency functions used by
+### the GUI, batch.py and benchmark.py. It only needs NumPy (no Tk, matplotlib,
+### scipy or pydub), so it imports quickly and works without a display.
+
+import numpy as np
+import bands
+import spectral
+
+
+# Function to convert amplitude to decibels (dB)
+def amplitude_to_db(amplitude):
+    return 20 * np.log10(np.abs(amplitude) + 1e-6)  # Small offset to avoid log(0)
+
+def calculate_highest_resonant_frequency(waveform, framerate, dtype=spectral.DEFAULT_DTYPE):
+    # Perform the real-valued Fourier Transform, which only computes the positive frequencies
+    positive_freqs, magnitude = spectral.rfft_spectrum(waveform, framerate, dtype)
+
+    return resonant_frequency_from_spectrum(positive_freqs, magnitude, framerate)
+
+
+# Finds the highest resonant frequency from an already computed positive frequency spectrum
+def resonant_frequency_from_spectrum(positive_freqs, magnitude, framerate):
+    # Ignore the DC component (zero frequency) to avoid the peak at 0 Hz
+    return clamp_resonant_frequency(spectral.peak_frequency(positive_freqs, magnitude), framerate)
+
+
+# Keeps a resonant frequency safely below the Nyquist limit
+def clamp_resonant_frequency(highest_resonant_frequency, framerate):
+    # Ensure the resonant frequency is within the Nyquist limit
+    nyquist_limit = framerate / 2
+    if highest_resonant_frequency > nyquist_limit:
+        print(f"Warning: Calculated resonant frequency {highest_resonant_frequency} Hz is above the Nyquist limit of {nyquist_limit} Hz.")
+        highest_resonant_frequency = nyquist_limit  # Clamp to Nyquist limit
+
+    # Clamp if the frequency is too close to Nyquist
+    if highest_resonant_frequency > nyquist_limit - 100:
+        print(f"Warning: Resonant frequency is too close to Nyquist limit. Clamping to {nyquist_limit - 100} Hz.")
+        highest_resonant_frequency = nyquist_limit - 100  # Force it to be 100 Hz below Nyquist
+
+    return highest_resonant_frequency
+
+
+# Streaming version of calculate_highest_resonant_frequency for long recordings
+# Takes an iterable of sample blocks and averages chunked spectra (Welch's method) with
+# the given frequency resolution, so memory use is constant however long the input is
+# Yields (seconds_processed, highest_resonant_frequency, band_peaks) after every block
+# welch, if given, is the spectral.WelchSpectrum the blocks are added to, so the caller
+# can use the final averaged spectrum afterwards (see analysiscache.AudioAnalysis.spectrum)
+def stream_resonant_frequency(blocks, framerate, resolution=spectral.DEFAULT_RESOLUTION, welch=None):
+    if welch is None:
+        welch = spectral.WelchSpectrum(framerate, resolution)
+    for block in blocks:
+        welch.update(block)
+        positive_freqs, magnitude = welch.spectrum()
+        highest_resonant_frequency = resonant_frequency_from_spectrum(positive_freqs, magnitude, framerate)
+        band_peaks = bands.band_peaks(positive_freqs, amplitude_to_db(magnitude))
+        yield welch.samples_seen / framerate, highest_resonant_frequency, band_peaks
@@ -0,0 +1,179 @@
+### This file holds the persistent analysis index. Derived data (spectrum,
+### band peaks, heatmap, waveform pyramid) is stored in a SQLite database keyed
+### by a hash of the file contents, so reopening a recording in the GUI or the
+### batch tool loads the results instead of recomputing them.
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+
+# Default location and size cap of the index, both can be set with environment variables
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".cache", "spidam")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# Bytes read at a time while hashing a file
+HASH_CHUNK = 1 << 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    content_hash TEXT NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    PRIMARY KEY (content_hash, name)
+);
+CREATE INDEX IF NOT EXISTS artifacts_by_access ON artifacts (last_access);
+"""
+
+
+# Hash of a file's contents, read in chunks
+# progress, if given, is called with the fraction of the file hashed after each chunk
+def hash_file(file_path, progress=None):
+    digest = hashlib.blake2b(digest_size=16)
+    size = max(os.path.getsize(file_path), 1)
+    done = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+            done += len(chunk)
+            if progress is not None:
+                progress(min(1.0, done / size))
+    return digest.hexdigest()
+
+
+# SQLite store of analysis artifacts with a size cap and least recently used eviction
+class AnalysisIndex:
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        if path is None:
+            path = os.path.join(DEFAULT_INDEX_DIR, "index.sqlite")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+
+        # One connection shared by the GUI worker threads, batch workers each open their own
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    # Returns the content hash of a file, only re-hashing it when its size or mtime changed
+    # Artifacts of a replaced version that no other file refers to are removed
+    # progress is passed on to hash_file
+    def content_hash(self, file_path, progress=None):
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT mtime_ns, size, content_hash FROM files WHERE path = ?",
+                                   (path,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return row[2]
+
+        content_hash = hash_file(path, progress)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)",
+                             (path, stat.st_mtime_ns, stat.st_size, content_hash))
+            if row is not None and row[2] != content_hash:
+                self._db.execute("DELETE FROM artifacts WHERE content_hash = ? AND NOT EXISTS "
+                                 "(SELECT 1 FROM files WHERE content_hash = ?)", (row[2], row[2]))
+        return content_hash
+
+    # Returns the stored arrays of an artifact as a dict, or None if it is not stored
+    def load(self, content_hash, name):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM artifacts WHERE content_hash = ? AND name = ?",
+                                   (content_hash, name)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute("UPDATE artifacts SET last_access = ? WHERE content_hash = ? AND name = ?",
+                                 (time.time(), content_hash, name))
+        with np.load(io.BytesIO(row[0]), allow_pickle=False) as stored:
+            return {key: stored[key] for key in stored.files}
+
+    # Stores the arrays of an artifact, then evicts old artifacts if over the size cap
+    def save(self, content_hash, name, arrays):
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        data = buffer.getvalue()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?, ?)",
+                             (content_hash, name, data, len(data), time.time()))
+        self.trim()
+
+    # Deletes the least recently used artifacts until the index fits its size cap
+    def trim(self):
+        with self._lock, self._db:
+            total = self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM artifacts").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = self._db.execute("SELECT content_hash, name, nbytes FROM artifacts "
+                                    "ORDER BY last_access").fetchall()
+            for content_hash, name, nbytes in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM artifacts WHERE content_hash = ? AND name = ?",
+                                 (content_hash, name))
+                total -= nbytes
+
+    def nbytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM artifacts").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM artifacts")
+            self._db.execute("DELETE FROM files")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    # Returns the artifacts of one file
+    def for_file(self, file_path, progress=None):
+        return FileArtifacts(self, self.content_hash(file_path, progress))
+
+
+# The stored artifacts of one file (one content hash)
+class FileArtifacts:
+    def __init__(self, index, content_hash):
+        self.index = index
+        self.content_hash = content_hash
+
+    def load(self, name):
+        return self.index.load(self.content_hash, name)
+
+    def save(self, name, **arrays):
+        self.index.save(self.content_hash, name, arrays)
+
+
+_default_index = None
+_default_lock = threading.Lock()
+
+
+# Returns the shared index, configured with SPIDAM_INDEX_DIR and SPIDAM_INDEX_MAX_MB,
+# or None if it is disabled with SPIDAM_INDEX=0 or cannot be opened
+def default_index():
+    global _default_index
+    if os.environ.get("SPIDAM_INDEX", "1") == "0":
+        return None
+    with _default_lock:
+        if _default_index is None:
+            index_dir = os.environ.get("SPIDAM_INDEX_DIR", DEFAULT_INDEX_DIR)
+            max_bytes = int(float(os.environ.get("SPIDAM_INDEX_MAX_MB", DEFAULT_MAX_BYTES / 2**20)) * 2**20)
+            try:
+                _default_index = AnalysisIndex(os.path.join(index_dir, "index.sqlite"), max_bytes)
+            except (OSError, sqlite3.Error) as error:
+                print(f"Warning: analysis index disabled ({error})")
+                _default_index = False
+        return _default_index or None
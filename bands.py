@@ -0,0 +1,151 @@
+### This file holds the frequency band registry. A band set maps band names to
+### (low, high) edges in Hz, and is turned into bin index ranges once per
+### spectrum grid, so the peaks and energies of every band are found in one
+### vectorized pass (np.maximum.reduceat / np.add.reduceat) over the spectrum.
+
+import threading
+import numpy as np
+import spectral
+
+# ISO nominal centre frequencies (Hz), used as band names
+OCTAVE_CENTRES = (31.5, 63, 125, 250, 500, 1000, 2000, 4000, 8000, 16000)
+THIRD_OCTAVE_CENTRES = (25, 31.5, 40, 50, 63, 80, 100, 125, 160, 200, 250, 315, 400, 500, 630, 800,
+                        1000, 1250, 1600, 2000, 2500, 3150, 4000, 5000, 6300, 8000, 10000, 12500, 16000, 20000)
+
+
+# Builds fractional-octave bands (fraction=1 for octaves, 3 for third octaves)
+# The exact centres are 1000 Hz * 2^(k / fraction) (base 2), named after the nominal centres
+def fractional_octave_bands(nominal_centres, fraction=1):
+    bands = {}
+    for nominal in nominal_centres:
+        k = round(fraction * np.log2(nominal / 1000))
+        centre = 1000 * 2 ** (k / fraction)
+        half_width = 2 ** (1 / (2 * fraction))
+        name = f"{nominal:g} Hz" if nominal < 1000 else f"{nominal / 1000:g} kHz"
+        bands[name] = (centre / half_width, centre * half_width)
+    return bands
+
+
+# Frequency ranges (Hz) of the low, mid and high bands, None means up to Nyquist
+FREQUENCY_BANDS = {
+    'low': (5, 300),
+    'mid': (300, 2000),
+    'high': (2000, None),
+}
+
+# Registered band sets, more can be added with register_band_set
+BAND_SETS = {
+    'basic': FREQUENCY_BANDS,
+    'octave': fractional_octave_bands(OCTAVE_CENTRES, 1),
+    'third_octave': fractional_octave_bands(THIRD_OCTAVE_CENTRES, 3),
+}
+
+DEFAULT_BAND_SET = 'basic'
+
+# Plot colors of the basic bands, shared by the swap and combine views
+BAND_COLORS = {'low': 'green', 'mid': 'yellow', 'high': 'red'}
+
+
+# Adds (or replaces) a named band set, bands maps names to (low, high) Hz, high may be None
+def register_band_set(name, bands):
+    with _layout_lock:
+        BAND_SETS[name] = dict(bands)
+        for key in [key for key in _layout_cache if key[0] == name]:
+            del _layout_cache[key]
+
+
+def get_band_set(name=DEFAULT_BAND_SET):
+    if name not in BAND_SETS:
+        raise ValueError(f"Unknown band set '{name}', choose from {sorted(BAND_SETS)}")
+    return BAND_SETS[name]
+
+
+# The bin index ranges of a band set on one spectrum grid
+class BandLayout:
+    def __init__(self, bands, freq):
+        self.names = list(bands)
+        self.n_bins = len(freq)
+        edges = [spectral.band_slice(freq, low, high) for low, high in bands.values()]
+        self.starts = np.array([edge.start for edge in edges], dtype=np.intp)
+        self.stops = np.array([edge.stop for edge in edges], dtype=np.intp)
+        self.slices = dict(zip(self.names, edges))
+
+        # reduceat takes a flat list of segment starts: each band is the segment
+        # [start, stop) and the segments in between are ignored
+        # An index may not equal the length, so bands reaching the last bin stop one short
+        # and get the last bin added afterwards
+        last = max(self.n_bins - 1, 0)
+        self._indices = np.empty(2 * len(edges), dtype=np.intp)
+        self._indices[0::2] = np.minimum(self.starts, last)
+        self._indices[1::2] = np.minimum(self.stops, last)
+        self._empty = self.stops <= self.starts
+        self._add_last = (self.stops == self.n_bins) & (self.starts < last)
+
+        # For the peaks the bins of every band are gathered one band after another (bands may
+        # share an edge bin), so one reduceat over the gathered values gives every maximum
+        lengths = np.maximum(self.stops - self.starts, 0)
+        offsets = np.cumsum(lengths) - lengths
+        self._bins = np.arange(lengths.sum()) + np.repeat(self.starts - offsets, lengths)
+        self._lengths = lengths[~self._empty]
+        self._offsets = offsets[~self._empty]
+
+    # Largest value of every band (NaN for a band without bins)
+    def maxima(self, values):
+        peaks = np.maximum.reduceat(values, self._indices)[0::2].astype(np.float64)
+        peaks[self._add_last] = np.maximum(peaks[self._add_last], values[-1])
+        peaks[self._empty] = np.nan
+        return peaks
+
+    # Sum of the values of every band
+    def sums(self, values):
+        sums = np.add.reduceat(values, self._indices, dtype=np.float64)[0::2]
+        sums[self._add_last] += values[-1]
+        sums[self._empty] = 0.0
+        return sums
+
+    # Peak (frequency, value) of every band as a dict keyed by band name
+    # The peak bin of a band is its first bin equal to the band maximum
+    def peaks(self, freq, values):
+        frequencies = np.full(len(self.names), np.nan)
+        maxima = np.full(len(self.names), np.nan)
+        if len(self._offsets):
+            gathered = values[self._bins]
+            band_maxima = np.maximum.reduceat(gathered, self._offsets)
+            hits = np.flatnonzero(gathered == np.repeat(band_maxima, self._lengths))
+            frequencies[~self._empty] = freq[self._bins[hits[np.searchsorted(hits, self._offsets)]]]
+            maxima[~self._empty] = band_maxima
+        return {name: (peak_freq, peak) for name, peak_freq, peak in zip(self.names, frequencies, maxima)}
+
+    # Energy (sum of squared magnitudes) of every band as a dict keyed by band name
+    def energies(self, magnitude):
+        return dict(zip(self.names, self.sums(np.square(magnitude, dtype=np.float64))))
+
+
+# Layouts are built once per (band set, spectrum length, bin spacing) and shared
+_layout_cache = {}
+_layout_lock = threading.Lock()
+
+
+# Returns the (cached) layout of a band set (a registered name or a dict of bands) on the
+# given frequency grid
+def band_layout(freq, band_set=DEFAULT_BAND_SET):
+    bands = get_band_set(band_set) if isinstance(band_set, str) else band_set
+    name = band_set if isinstance(band_set, str) else tuple(bands.items())
+    # freq[1] is framerate / n_fft, so with the length it identifies the grid
+    key = (name, len(freq), float(freq[1]) if len(freq) > 1 else 0.0)
+    with _layout_lock:
+        layout = _layout_cache.get(key)
+        if layout is None:
+            layout = BandLayout(bands, freq)
+            _layout_cache[key] = layout
+        return layout
+
+
+# Peak (frequency, value) of every band in the set
+def band_peaks(freq, values, band_set=DEFAULT_BAND_SET):
+    return band_layout(freq, band_set).peaks(freq, values)
+
+
+# Energy of every band in the set, from a magnitude spectrum
+def band_energies(freq, magnitude, band_set=DEFAULT_BAND_SET):
+    return band_layout(freq, band_set).energies(magnitude)
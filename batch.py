@@ -0,0 +1,153 @@
+### This file runs the audio analysis without the GUI, so it can be used on a
+### server. It analyzes every WAV/MP3 file in the given directories or glob
+### patterns across all CPU cores and writes the results as JSON or CSV.
+###
+### Example: python batch.py recordings/ "archive/**/*.mp3" --format csv -o results.csv
+
+import argparse
+import contextlib
+import csv
+import glob
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import analysiscore
+import analysiscache
+import analysisindex
+import bands
+import profiling
+import spectral
+
+AUDIO_EXTENSIONS = (".wav", ".mp3")
+
+# Column order of the CSV output
+CSV_FIELDS = ["file", "duration", "highest_resonant_frequency"] + [
+    f"{band}_peak_{value}" for band in bands.FREQUENCY_BANDS for value in ("frequency", "db")
+] + [f"{band}_rt60" for band in bands.FREQUENCY_BANDS] + ["error"]
+
+
+# Expands directories and glob patterns into a sorted list of audio files
+def find_audio_files(paths, recursive=False):
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*") if recursive else os.path.join(path, "*")
+            candidates = glob.glob(pattern, recursive=recursive)
+        else:
+            candidates = glob.glob(path, recursive=True)
+        files.update(c for c in candidates if os.path.isfile(c) and c.lower().endswith(AUDIO_EXTENSIONS))
+    return sorted(files)
+
+
+# Computes the metrics of one file, this runs inside a worker process
+# With trace set the stages are timed and returned under the "trace" key
+def analyze_file(file_path, dtype=spectral.DEFAULT_DTYPE, trace=False):
+    result = {"file": file_path}
+    if trace:
+        # Worker processes do not run exit handlers, so the events go back with the result
+        tracer = profiling.enable()
+    try:
+        # Warnings printed by the analysis go to stderr so they never mix with the results
+        with contextlib.redirect_stdout(sys.stderr):
+            analysis = analysiscache.AudioAnalysis.from_file(file_path, index=analysisindex.default_index(),
+                                                             dtype=dtype)
+            highest_resonant_frequency = analysiscore.clamp_resonant_frequency(analysis.peak_frequency(), analysis.framerate)
+
+        result["duration"] = analysis.duration
+        result["highest_resonant_frequency"] = float(highest_resonant_frequency)
+        for band, (peak_freq, peak_value) in analysis.band_peaks().items():
+            result[f"{band}_peak_frequency"] = float(peak_freq)
+            result[f"{band}_peak_db"] = float(peak_value)
+        for band, times in analysis.decay_times().items():
+            result[f"{band}_rt60"] = times["rt60"]
+    except Exception as error:
+        result["error"] = f"{type(error).__name__}: {error}"
+    if trace:
+        result["trace"] = tracer.drain()
+    return result
+
+
+# Analyzes all files in a process pool, results are returned in input order
+def analyze_files(files, workers=None, progress=None, dtype=spectral.DEFAULT_DTYPE, trace=False):
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(analyze_file, file_path, dtype, trace): file_path for file_path in files}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if progress is not None:
+                progress(len(results), len(files), futures[future])
+    return [results[file_path] for file_path in files]
+
+
+# NaN (e.g. the RT60 of a band without enough decay) is not valid JSON, so values that are
+# not finite are written as null
+def write_json(results, out):
+    results = [{key: None if isinstance(value, float) and not math.isfinite(value) else value
+                for key, value in result.items()} for result in results]
+    json.dump(results, out, indent=2, allow_nan=False)
+    out.write("\n")
+
+
+def write_csv(results, out):
+    writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze audio files without the GUI.")
+    parser.add_argument("paths", nargs="+", help="audio files, directories or glob patterns")
+    parser.add_argument("-f", "--format", choices=("json", "csv"), default="json", help="output format")
+    parser.add_argument("-o", "--output", help="output file (default: standard output)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("-r", "--recursive", action="store_true", help="search directories recursively")
+    parser.add_argument("--no-index", action="store_true",
+                        help="do not use the persistent analysis index or the decoded audio cache")
+    parser.add_argument("--float32", action="store_true", help="analyze in single precision (faster, less memory)")
+    parser.add_argument("--trace", metavar="FILE", help="write a timing trace of every stage (Chrome trace format)")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not report progress on stderr")
+    args = parser.parse_args(argv)
+
+    # Worker processes inherit the environment, so this disables the caches for all of them
+    if args.no_index:
+        os.environ["SPIDAM_INDEX"] = "0"
+        os.environ["SPIDAM_PCM_CACHE"] = "0"
+
+    files = find_audio_files(args.paths, args.recursive)
+    if not files:
+        parser.error("no .wav or .mp3 files found")
+
+    def report(done, total, file_path):
+        if not args.quiet:
+            print(f"[{done}/{total}] {file_path}", file=sys.stderr)
+
+    dtype = np.float32 if args.float32 else np.float64
+    if args.trace:
+        tracer = profiling.enable()
+        with profiling.stage('batch', files=len(files)):
+            results = analyze_files(files, args.workers, report, dtype, trace=True)
+        worker_events = [event for result in results for event in result.pop("trace", [])]
+        tracer.write(args.trace, worker_events)
+        if not args.quiet:
+            for name, (milliseconds, count) in profiling.summarize(worker_events).items():
+                print(f"{name:>24} {milliseconds:10.1f} ms  ({count}x)", file=sys.stderr)
+    else:
+        results = analyze_files(files, args.workers, report, dtype)
+
+    write = write_json if args.format == "json" else write_csv
+    if args.output:
+        with open(args.output, "w", newline="") as out:
+            write(results, out)
+    else:
+        write(results, sys.stdout)
+
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,373 @@
+### This file benchmarks the analysis and rendering hot paths. It generates
+### synthetic WAV files, times each stage (decode, FFT, band masking, STFT,
+### waveform pyramid, RT60 and figure rendering with the headless Agg backend),
+### measures peak memory in a separate untimed run, and writes the results as
+### JSON so runs can be compared.
+###
+### Examples:
+###   python benchmark.py                          quick run (1 s and 10 s files)
+###   python benchmark.py --preset full -o new.json
+###   python benchmark.py --compare old.json new.json
+###   python benchmark.py --legacy-stft            vectorized STFT vs the original loop
+###   python benchmark.py --startup -o new.json    import and window start-up times
+
+import matplotlib
+matplotlib.use('Agg')  # Must be chosen before anything imports pyplot
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from datetime import datetime, timezone
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import AnalyticsModel as am
+import analysiscore
+import analysiscache
+import bands
+import spectral
+import visualization
+import wavreader
+
+SIGNALS = ('sweep', 'noise', 'multitone')
+
+# Parameter sets for --preset, any of them can be overridden on the command line
+PRESETS = {
+    'quick': {'durations': [1, 10], 'rates': [44100], 'channels': [1, 2]},
+    'standard': {'durations': [1, 10, 60, 600], 'rates': [22050, 44100, 48000], 'channels': [1, 2]},
+    'full': {'durations': [1, 10, 60, 600, 3600], 'rates': [22050, 44100, 48000, 96000], 'channels': [1, 2]},
+}
+
+# Frames generated and written at a time, so even 1 hour files are created with little memory
+WRITE_CHUNK = 1 << 20
+
+
+# Returns one chunk of a synthetic test signal (float, roughly within [-1, 1])
+def synthetic_chunk(signal, start, count, framerate, duration, rng):
+    t = (start + np.arange(count)) / framerate
+    if signal == 'sweep':
+        # Exponential sine sweep from 20 Hz to just below Nyquist
+        f0, f1 = 20.0, framerate * 0.45
+        rate = np.log(f1 / f0) / duration
+        return 0.8 * np.sin(2 * np.pi * f0 * (np.exp(rate * t) - 1) / rate)
+    if signal == 'noise':
+        return 0.3 * rng.standard_normal(count)
+    if signal == 'multitone':
+        tones = (110, 440, 1000, 3500, 8000)
+        return sum(np.sin(2 * np.pi * f * t) for f in tones) / len(tones)
+    raise ValueError(f"Unknown signal '{signal}'")
+
+
+# Writes a 16-bit synthetic WAV file
+def write_synthetic_wav(file_path, signal, duration, framerate, channels, seed=0):
+    rng = np.random.default_rng(seed)
+    n_frames = int(duration * framerate)
+    with wave.open(file_path, 'wb') as wav_file:
+        wav_file.setnchannels(channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(framerate)
+        for start in range(0, n_frames, WRITE_CHUNK):
+            count = min(WRITE_CHUNK, n_frames - start)
+            mono = synthetic_chunk(signal, start, count, framerate, duration, rng)
+            # Later channels are quieter copies so the downmix is not trivial
+            frames = np.column_stack([mono * (0.5 ** c) for c in range(channels)])
+            wav_file.writeframes((frames * 32767).astype('<i2').tobytes())
+
+
+# Runs func once and returns (result, seconds)
+# Timing runs without tracemalloc, which slows down allocation-heavy code several times over
+def measure(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+# Runs func once under tracemalloc and returns the peak traced bytes it allocated
+def measure_peak(func):
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        return tracemalloc.get_traced_memory()[1] - base
+    finally:
+        if started:
+            tracemalloc.stop()
+
+
+# Draws a figure with the Agg backend (what the Tk canvas does on screen)
+def render(fig):
+    FigureCanvasAgg(fig).draw()
+
+
+# Times every stage of the pipeline on one file, each stage starting from a fresh analysis
+# so nothing is shared through the caches
+def bench_file(file_path, repeat=1, dtype=spectral.DEFAULT_DTYPE):
+    stages = {}
+
+    # The timed runs come first, then one more run measures the memory
+    def run(stage, func):
+        best = None
+        for _ in range(repeat):
+            result, seconds = measure(func)
+            best = seconds if best is None else min(best, seconds)
+        stages[stage] = {'seconds': best, 'peak_bytes': measure_peak(func)}
+        return result
+
+    # Decode: open/memory-map and downmix, then touch every sample
+    def decode():
+        analysis = analysiscache.AudioAnalysis.from_file(file_path, dtype=dtype)
+        for start in range(0, analysis.n_frames, wavreader.DEFAULT_CHUNK_FRAMES):
+            np.add.reduce(analysis.waveform[start:start + wavreader.DEFAULT_CHUNK_FRAMES], dtype=np.float64)
+        return analysis
+    analysis = run('decode', decode)
+
+    fresh = lambda: analysiscache.AudioAnalysis(analysis.waveform, analysis.framerate, dtype=dtype)
+    run('fft', lambda: fresh().spectrum())
+    freq, magnitude = analysis.spectrum()
+    amplitude_db = analysiscore.amplitude_to_db(magnitude)
+    run('band_masking', lambda: bands.band_peaks(freq, amplitude_db))
+    run('resonant_frequency', lambda: analysiscore.resonant_frequency_from_spectrum(freq, magnitude, analysis.framerate))
+    run('stft', lambda: fresh().stft())
+    run('pyramid', lambda: fresh().waveform_pyramid())
+    run('reverb', lambda: fresh().decay_times('octave'))
+
+    # Rendering uses the fully prepared analysis so only figure building and drawing is timed
+    analysis.spectrum_db()
+    analysis.band_peaks()
+    analysis.waveform_pyramid()
+    stft_result = analysis.stft()
+    run('render_waveform', lambda: render(am.waveform_figure(analysis)))
+    run('render_band', lambda: render(am.timeseries_figure(analysis, 'low')))
+    run('render_combined', lambda: render(visualization.timeseries_general_figure(analysis, 'all')))
+    run('render_heatmap', lambda: render(visualization.specgram_figure(*stft_result)))
+    return stages
+
+
+def run_suite(args):
+    preset = PRESETS[args.preset]
+    durations = args.durations or preset['durations']
+    rates = args.rates or preset['rates']
+    channels_list = args.channels or preset['channels']
+    signals = args.signals or list(SIGNALS)
+
+    # The persistent index would turn repeated runs into cache lookups
+    os.environ["SPIDAM_INDEX"] = "0"
+
+    # scipy and matplotlib are imported on first use (see reverb.py, AnalyticsModel.py), which
+    # must not be counted as the time of the first stage that needs them
+    import scipy.signal
+    import plotsurface
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="spidam-bench-") as work_dir:
+        for duration in durations:
+            for framerate in rates:
+                for channels in channels_list:
+                    for signal in signals:
+                        case = f"{signal}-{duration}s-{framerate}Hz-{channels}ch"
+                        file_path = os.path.join(work_dir, case + ".wav")
+                        write_synthetic_wav(file_path, signal, duration, framerate, channels)
+                        stages = bench_file(file_path, args.repeat, np.dtype(args.dtype))
+                        os.remove(file_path)
+
+                        for stage, values in stages.items():
+                            results.append({'case': case, 'signal': signal, 'duration': duration,
+                                            'framerate': framerate, 'channels': channels,
+                                            'stage': stage, **values})
+                        total = sum(values['seconds'] for values in stages.values())
+                        print(f"{case:32s} {total * 1000:10.1f} ms  " +
+                              "  ".join(f"{stage}={values['seconds'] * 1000:.1f}" for stage, values in stages.items()),
+                              file=sys.stderr)
+
+    output = {'meta': run_metadata(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(output, out, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+def run_metadata(args):
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    except ImportError:  # Not available on Windows
+        max_rss = None
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'preset': args.preset,
+        'repeat': args.repeat,
+        'dtype': args.dtype,
+        'max_rss_kb': max_rss,
+    }
+
+
+# Prints the time ratio of every (case, stage) present in both result files
+def compare(old_path, new_path, threshold=1.10):
+    with open(old_path) as f:
+        old = {(r['case'], r['stage']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['case'], r['stage']): r for r in json.load(f)['results']}
+
+    regressions = 0
+    print(f"{'case':32s} {'stage':20s} {'old ms':>10s} {'new ms':>10s} {'ratio':>7s}")
+    for key in sorted(old.keys() & new.keys()):
+        old_seconds, new_seconds = old[key]['seconds'], new[key]['seconds']
+        ratio = new_seconds / old_seconds if old_seconds > 0 else float('inf')
+        flag = "  SLOWER" if ratio > threshold else ""
+        regressions += ratio > threshold
+        print(f"{key[0]:32s} {key[1]:20s} {old_seconds * 1000:10.2f} {new_seconds * 1000:10.2f} {ratio:7.2f}{flag}")
+    print(f"{regressions} stage(s) slower than {threshold:.2f}x")
+    return 1 if regressions else 0
+
+
+# The original per-frame heatmap loop from visualization.plot_specgram, kept for comparison
+def legacy_specgram(sample_data, window_size=1024, hop_size=512):
+    num_frames = (len(sample_data) - window_size) // hop_size
+    heatmap = np.zeros((window_size // 2, num_frames))
+    for i in range(num_frames):
+        start_idx = i * hop_size
+        end_idx = start_idx + window_size
+        windowed_samples = sample_data[start_idx:end_idx] * np.hanning(window_size)
+        spectrum = np.fft.fft(windowed_samples)
+        spectrum = np.fft.fftshift(spectrum)[:window_size // 2]
+        heatmap[:, i] = np.abs(spectrum)
+    return heatmap
+
+
+# Runs a function a few times and returns the best time in seconds
+def best_time(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_legacy_stft(seconds=60, framerate=44100):
+    rng = np.random.default_rng(0)
+    chunk = synthetic_chunk('multitone', 0, int(seconds * framerate), framerate, seconds, rng)
+    samples = (chunk * 20000 + 2000 * rng.standard_normal(len(chunk))).astype(np.int16)
+
+    legacy = legacy_specgram(samples)
+    _, _, magnitude = spectral.stft(samples, framerate)
+
+    # The legacy rows are the fftshifted negative-frequency bins, which for real input are
+    # the positive bins 1..N/2 in reverse order
+    expected = magnitude[1:, :legacy.shape[1]][::-1]
+    max_error = np.max(np.abs(expected - legacy)) / np.max(legacy)
+
+    legacy_time = best_time(lambda: legacy_specgram(samples))
+    stft64_time = best_time(lambda: spectral.stft(samples, framerate))
+    stft32_time = best_time(lambda: spectral.stft(samples, framerate, dtype=np.float32))
+
+    print(f"STFT on {seconds} s @ {framerate} Hz ({legacy.shape[1]} frames)")
+    print(f"  legacy loop      {legacy_time * 1000:9.1f} ms")
+    print(f"  stft float64     {stft64_time * 1000:9.1f} ms  ({legacy_time / stft64_time:.1f}x)")
+    print(f"  stft float32     {stft32_time * 1000:9.1f} ms  ({legacy_time / stft32_time:.1f}x)")
+    print(f"  max relative error vs legacy: {max_error:.2e}")
+
+
+# Start-up probes, each run in a fresh interpreter: the modules imported, and for 'window' the
+# time until the main window has been drawn (build_window is absent in checkouts from before
+# it existed, where importing guicontroller builds the window)
+STARTUP_PROBES = {
+    'import_analysiscore': "import analysiscore",
+    'import_AnalyticsModel': "import AnalyticsModel",
+    'import_analysiscache': "import analysiscache",
+    'import_visualization': "import visualization",
+    'window': "import visualization, guicontroller\n"
+              "getattr(guicontroller, 'build_window', lambda: None)()\n"
+              "guicontroller.root.update()",
+}
+
+
+# Runs one start-up probe in a new Python process with tree as the working directory,
+# returns the seconds it took, or None if it failed (e.g. 'window' without a display)
+def run_startup_probe(code, tree):
+    script = ("import time\n_start = time.perf_counter()\n" + code +
+              "\nprint(time.perf_counter() - _start)\n")
+    env = dict(os.environ, SPIDAM_TRACE="0", SPIDAM_INDEX="0")
+    env.pop("MPLBACKEND", None)
+    process = subprocess.run([sys.executable, "-c", script], cwd=tree, env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        return None
+    return float(process.stdout.strip().splitlines()[-1])
+
+
+# Measures the start-up probes (median of repeat runs) on a checkout of the project, so an
+# older version can be measured with e.g. `git worktree add /tmp/old <commit>` and --tree /tmp/old
+def run_startup(args):
+    tree = os.path.abspath(args.tree)
+    results = []
+    for probe, code in STARTUP_PROBES.items():
+        times = [run_startup_probe(code, tree) for _ in range(max(args.repeat, 5))]
+        times = [seconds for seconds in times if seconds is not None]
+        if not times:
+            print(f"{probe:24s}    skipped (failed, no display?)", file=sys.stderr)
+            continue
+        seconds = float(np.median(times))
+        results.append({'case': 'startup', 'stage': probe, 'seconds': seconds, 'runs': len(times)})
+        print(f"{probe:24s} {seconds * 1000:10.1f} ms", file=sys.stderr)
+
+    output = {'meta': {**run_metadata(args), 'tree': tree}, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(output, out, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        json.dump(output, sys.stdout, indent=2)
+        print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis and rendering hot paths.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick", help="parameter set to run")
+    parser.add_argument("--durations", type=float, nargs="+", help="file durations in seconds")
+    parser.add_argument("--rates", type=int, nargs="+", help="sample rates in Hz")
+    parser.add_argument("--channels", type=int, nargs="+", help="channel counts")
+    parser.add_argument("--signals", choices=SIGNALS, nargs="+", help="synthetic signals")
+    parser.add_argument("--dtype", choices=("float64", "float32"), default="float64", help="analysis precision")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is kept")
+    parser.add_argument("-o", "--output", help="write JSON results to this file (default: standard output)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    parser.add_argument("--legacy-stft", action="store_true", help="compare the STFT with the original loop")
+    parser.add_argument("--startup", action="store_true", help="measure import and window start-up times")
+    parser.add_argument("--tree", default=os.path.dirname(os.path.abspath(__file__)),
+                        help="project checkout measured by --startup (default: this one)")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+    if args.legacy_stft:
+        bench_legacy_stft()
+        return 0
+    if args.startup:
+        run_startup(args)
+        return 0
+    run_suite(args)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+### This file holds the multi-file comparison session. Every file of a set (e.g.
+### several takes of the same room) is analyzed in a worker process, which
+### reduces its spectrum, waveform and heatmap to small fixed-size arrays and
+### hands them back through a shared memory block instead of pickling them.
+### The plots (see the Compare views in plotsurface.py) only ever draw these
+### reduced arrays, so they stay responsive with dozens of files loaded.
+###
+### Example: python comparison.py take1.wav take2.wav take3.mp3 --view spectrum -o compare.png
+
+import argparse
+import atexit
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import analysiscache
+import analysisindex
+import bands
+import profiling
+import spectral
+
+# Points of the display spectrum, on a log frequency grid shared by all files
+SPECTRUM_POINTS = 1024
+SPECTRUM_RANGE = (10.0, 48000.0)
+
+# Min/max buckets of the waveform envelope (files with fewer samples keep every sample)
+WAVEFORM_POINTS = 2048
+
+# Size (frequency rows, time columns) the heatmap of every file is reduced to
+HEATMAP_SHAPE = (128, 256)
+
+# Worker processes, every worker holds the samples of one file at a time
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Edges and (geometric) centres of the display spectrum grid
+SPECTRUM_EDGES = np.geomspace(*SPECTRUM_RANGE, SPECTRUM_POINTS + 1)
+SPECTRUM_FREQS = np.sqrt(SPECTRUM_EDGES[:-1] * SPECTRUM_EDGES[1:])
+
+
+# Spectrum (in dB) reduced to the display grid: the peak of the bins inside every grid cell,
+# interpolated where a cell is narrower than the bin spacing, NaN above the Nyquist frequency
+def display_spectrum(freq, spectrum_db):
+    cells = {i: (low, high) for i, (low, high) in enumerate(zip(SPECTRUM_EDGES[:-1], SPECTRUM_EDGES[1:]))}
+    values = bands.BandLayout(cells, freq).maxima(spectrum_db)
+    inside = SPECTRUM_FREQS <= freq[-1]
+    missing = np.isnan(values) & inside
+    values[missing] = np.interp(SPECTRUM_FREQS[missing], freq, spectrum_db)
+    values[~inside] = np.nan
+    return values.astype(np.float32)
+
+
+# Resizes a 2-D array to exactly shape: an axis that is too long keeps the largest value of
+# every block of it, one that is too short repeats its entries
+def fit_tile(values, shape):
+    if values.size == 0:
+        return np.zeros(shape, dtype=values.dtype)
+    for axis, size in enumerate(shape):
+        length = values.shape[axis]
+        if length > size:
+            starts = (np.arange(size) * length) // size
+            values = np.maximum.reduceat(values, starts, axis=axis)
+        elif length < size:
+            values = np.take(values, (np.arange(size) * length) // size, axis=axis)
+    return np.ascontiguousarray(values)
+
+
+# Copies arrays into one new shared memory block, returns (block name, layout) where layout
+# maps every array name to (offset, shape, dtype)
+def pack_arrays(arrays):
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = (offset, array.shape, array.dtype.str)
+        offset += -(-array.nbytes // 64) * 64  # Every array starts 64 byte aligned
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, array in arrays.items():
+        start, shape, dtype = layout[name]
+        np.ndarray(shape, dtype, buffer=block.buf, offset=start)[...] = array
+    # The block stays alive after this process lets go of it, the session unlinks it
+    block.close()
+    return block.name, layout
+
+
+# Analyzes one file and returns (block name, layout, scalars), this runs inside a worker process
+# The analysis goes through the persistent index, so files seen before load quickly
+def precompute(file_path, dtype=spectral.DEFAULT_DTYPE):
+    analysis = analysiscache.AudioAnalysis.from_file(file_path, index=analysisindex.default_index(), dtype=dtype)
+    with profiling.stage('compare.reduce'):
+        freq, _ = analysis.spectrum()
+        times, mins, maxs = analysis.waveform_pyramid().overview(WAVEFORM_POINTS)
+        heat_freq, heat_time, heatmap_db = analysis.stft()
+        arrays = {
+            'spectrum_db': display_spectrum(freq, analysis.spectrum_db()),
+            'envelope_times': times.astype(np.float32),
+            'envelope_min': mins.astype(np.float32),
+            'envelope_max': maxs.astype(np.float32),
+            'heatmap_db': fit_tile(heatmap_db, HEATMAP_SHAPE),
+        }
+    scalars = {
+        'duration': analysis.duration,
+        'framerate': analysis.framerate,
+        'n_channels': analysis.n_channels,
+        'peak_frequency': analysis.peak_frequency(),
+        'band_peaks': {name: tuple(map(float, peak)) for name, peak in analysis.band_peaks().items()},
+        'peak_amplitude': float(max(abs(float(mins.min(initial=0))), abs(float(maxs.max(initial=0))))),
+        'heatmap_extent': (0.0, float(heat_time[-1]) if len(heat_time) else analysis.duration,
+                           float(heat_freq[0]), float(heat_freq[-1])),
+    }
+    return pack_arrays(arrays) + (scalars,)
+
+
+# The reduced analysis of one file of a comparison, its arrays are views of a shared memory block
+class FileSummary:
+    def __init__(self, file_path, identity=None, block_name=None, layout=None, scalars=None, error=None):
+        self.file_path = file_path
+        self.name = os.path.basename(file_path)
+        self.identity = identity
+        self.error = error
+        self.arrays = {}
+        self._block = None
+        for key, value in (scalars or {}).items():
+            setattr(self, key, value)
+        if block_name is not None:
+            self._block = shared_memory.SharedMemory(name=block_name)
+            self.arrays = {name: np.ndarray(shape, dtype, buffer=self._block.buf, offset=offset)
+                           for name, (offset, shape, dtype) in layout.items()}
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['arrays'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    # Frees the shared memory block (it disappears once no array views of it are left)
+    def release(self):
+        self.arrays = {}
+        if self._block is not None:
+            self._block.unlink()
+            try:
+                self._block.close()
+            except BufferError:
+                pass  # A plot still holds a view, the mapping goes away with it
+            self._block = None
+
+
+# A set of files being compared, results are kept per file so loading a set that shares
+# files with the previous one only analyzes the new files
+class ComparisonSession:
+    def __init__(self, workers=DEFAULT_WORKERS, dtype=spectral.DEFAULT_DTYPE):
+        self.workers = workers
+        self.dtype = dtype
+        self.summaries = {}  # File path: FileSummary
+        self._executor = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    # Worker processes are started with spawn, forking a process that runs Tk and threads is unsafe
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    # Makes file_paths the compared set and returns their summaries in the same order
+    # (failed files have .error set), progress(done, total, file_path) is called as files finish
+    # and may raise to stop loading (e.g. tasks.TaskCancelled)
+    def load(self, file_paths, progress=None):
+        file_paths = list(dict.fromkeys(file_paths))
+        identities = {}
+        for file_path in file_paths:
+            try:
+                identities[file_path] = analysiscache.file_identity(file_path)
+            except OSError as error:
+                identities[file_path] = None
+                self._replace(FileSummary(file_path, error=f"{type(error).__name__}: {error}"))
+
+        with self._lock:
+            for file_path in [path for path in self.summaries if path not in identities]:
+                self.summaries.pop(file_path).release()
+            pending = [path for path in file_paths if identities[path] is not None and
+                       (path not in self.summaries or self.summaries[path].identity != identities[path])]
+
+        done = len(file_paths) - len(pending)
+        futures = {self._pool().submit(precompute, path, self.dtype): path for path in pending}
+        remaining = set(futures)
+        try:
+            for future in as_completed(futures):
+                remaining.discard(future)
+                path = futures[future]
+                self._replace(self._summary(path, identities[path], future))
+                done += 1
+                if progress is not None:
+                    progress(done, len(file_paths), path)
+        finally:
+            # Stopped early: finished results still own a shared memory block that must be freed
+            for future in remaining:
+                future.cancel()
+                future.add_done_callback(_discard_result)
+
+        with self._lock:
+            return [self.summaries[path] for path in file_paths]
+
+    @staticmethod
+    def _summary(file_path, identity, future):
+        try:
+            return FileSummary(file_path, identity, *future.result())
+        except Exception as error:
+            return FileSummary(file_path, identity, error=f"{type(error).__name__}: {error}")
+
+    def _replace(self, summary):
+        with self._lock:
+            old = self.summaries.get(summary.file_path)
+            self.summaries[summary.file_path] = summary
+        if old is not None:
+            old.release()
+
+    def close(self):
+        with self._lock:
+            summaries, self.summaries = list(self.summaries.values()), {}
+            executor, self._executor = self._executor, None
+        for summary in summaries:
+            summary.release()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Frees the shared memory of a precompute result nobody is waiting for any more
+def _discard_result(future):
+    if not future.cancelled() and future.exception() is None:
+        FileSummary("", None, *future.result()).release()
+
+
+# Renders a comparison without the GUI
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare several audio files.")
+    parser.add_argument("files", nargs="+", help="audio files to compare")
+    parser.add_argument("--view", choices=("spectrum", "waveform", "heatmap"), default="spectrum",
+                        help="comparison to draw")
+    parser.add_argument("-o", "--output", required=True, help="image file to write (e.g. compare.png)")
+    parser.add_argument("-j", "--workers", type=int, default=DEFAULT_WORKERS, help="worker processes")
+    args = parser.parse_args(argv)
+
+    import plotsurface
+
+    session = ComparisonSession(args.workers)
+    summaries = session.load(args.files, progress=lambda done, total, path: print(
+        f"[{done}/{total}] {path}", file=sys.stderr))
+    for summary in summaries:
+        if summary.error:
+            print(f"{summary.file_path}: {summary.error}", file=sys.stderr)
+    figure = plotsurface.view_figure(plotsurface.COMPARE_VIEWS[args.view], summaries)
+    figure.savefig(args.output)
+    session.close()
+    return 1 if any(summary.error for summary in summaries) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+### This file holds the level-of-detail waveform renderer. Instead of handing
+### every sample to matplotlib, the waveform is reduced to per-pixel min/max
+### envelopes taken from a precomputed multi-resolution pyramid, and the raw
+### samples are only drawn once the view is zoomed in far enough.
+
+import numpy as np
+
+# Samples per bucket in the finest pyramid level
+BASE_BUCKET = 64
+
+# Each coarser level merges this many buckets of the level below it
+LEVEL_FACTOR = 4
+
+# Stop adding levels once a level has fewer buckets than this
+MIN_LEVEL_BUCKETS = 1024
+
+# Samples read at a time while building the finest level (a multiple of BASE_BUCKET)
+BUILD_CHUNK = BASE_BUCKET * 16384
+
+
+# Min/max summary of a waveform at several resolutions
+class MinMaxPyramid:
+    def __init__(self, samples, framerate):
+        self.samples = samples
+        self.framerate = framerate
+        self.n_samples = len(samples)
+
+        # Finest level, built chunk by chunk so memory-mapped input is never fully loaded
+        n_buckets = -(-self.n_samples // BASE_BUCKET)
+        mins = np.empty(n_buckets, dtype=samples.dtype)
+        maxs = np.empty(n_buckets, dtype=samples.dtype)
+        for start in range(0, self.n_samples, BUILD_CHUNK):
+            chunk = np.asarray(samples[start:start + BUILD_CHUNK])
+            first = start // BASE_BUCKET
+            starts = np.arange(0, len(chunk), BASE_BUCKET)
+            mins[first:first + len(starts)] = np.minimum.reduceat(chunk, starts)
+            maxs[first:first + len(starts)] = np.maximum.reduceat(chunk, starts)
+
+        # Coarser levels merge LEVEL_FACTOR buckets of the previous level
+        self.levels = [(BASE_BUCKET, mins, maxs)]
+        while len(mins) > MIN_LEVEL_BUCKETS:
+            starts = np.arange(0, len(mins), LEVEL_FACTOR)
+            mins = np.minimum.reduceat(mins, starts)
+            maxs = np.maximum.reduceat(maxs, starts)
+            self.levels.append((self.levels[-1][0] * LEVEL_FACTOR, mins, maxs))
+
+    # Rebuilds a pyramid from the arrays returned by to_arrays, without reading the samples
+    @classmethod
+    def from_arrays(cls, samples, framerate, arrays):
+        pyramid = cls.__new__(cls)
+        pyramid.samples = samples
+        pyramid.framerate = framerate
+        pyramid.n_samples = len(samples)
+        pyramid.levels = [(int(bucket), arrays[f'mins_{i}'], arrays[f'maxs_{i}'])
+                          for i, bucket in enumerate(arrays['buckets'])]
+        return pyramid
+
+    # The levels as a flat dict of arrays, for storing the pyramid
+    def to_arrays(self):
+        arrays = {'buckets': np.array([bucket for bucket, _, _ in self.levels])}
+        for i, (_, mins, maxs) in enumerate(self.levels):
+            arrays[f'mins_{i}'] = mins
+            arrays[f'maxs_{i}'] = maxs
+        return arrays
+
+    # Smallest and largest sample of the whole waveform
+    def value_range(self):
+        if self.n_samples == 0:
+            return 0, 0
+        _, mins, maxs = self.levels[-1]
+        return mins.min(), maxs.max()
+
+    # Returns the (x, y) line to draw for the time range [start_time, stop_time]
+    # on an axis `width_pixels` wide: the raw samples when zoomed in, otherwise
+    # a min/max pair per pixel from the coarsest level that is still fine enough
+    def envelope(self, start_time, stop_time, width_pixels):
+        start = max(0, int(np.floor(start_time * self.framerate)))
+        stop = min(self.n_samples, int(np.ceil(stop_time * self.framerate)) + 1)
+        if stop <= start:
+            return np.empty(0), np.empty(0)
+
+        samples_per_pixel = (stop - start) / max(1, width_pixels)
+        if samples_per_pixel < BASE_BUCKET:
+            return np.arange(start, stop) / self.framerate, np.asarray(self.samples[start:stop])
+
+        bucket, mins, maxs = self.levels[0]
+        for level in self.levels[1:]:
+            if level[0] > samples_per_pixel:
+                break
+            bucket, mins, maxs = level
+
+        first = start // bucket
+        last = -(-stop // bucket)
+        per_pixel = max(1, int(samples_per_pixel // bucket))
+        starts = np.arange(0, last - first, per_pixel)
+        pixel_mins = np.minimum.reduceat(mins[first:last], starts)
+        pixel_maxs = np.maximum.reduceat(maxs[first:last], starts)
+
+        pixel_times = (first + starts) * bucket / self.framerate
+        return np.repeat(pixel_times, 2), np.column_stack([pixel_mins, pixel_maxs]).ravel()
+
+    # Returns (times, mins, maxs) of the whole waveform reduced to at most n_points buckets, merged
+    # from the coarsest level that still has n_points buckets (from the samples for short waveforms)
+    def overview(self, n_points):
+        if self.n_samples == 0:
+            return np.empty(0), np.empty(0, dtype=self.samples.dtype), np.empty(0, dtype=self.samples.dtype)
+        bucket, mins, maxs = 1, np.asarray(self.samples), np.asarray(self.samples)
+        for level in self.levels:
+            if len(level[1]) < n_points:
+                break
+            bucket, mins, maxs = level
+
+        n_points = min(n_points, len(mins))
+        starts = (np.arange(n_points) * len(mins)) // n_points
+        return (starts * bucket / self.framerate,
+                np.minimum.reduceat(mins, starts), np.maximum.reduceat(maxs, starts))
+
+    def nbytes(self):
+        return sum(mins.nbytes + maxs.nbytes for _, mins, maxs in self.levels)
+
+
+# Draws a MinMaxPyramid on a matplotlib axis and refreshes the envelope whenever
+# the visible time range changes, so only about two points per pixel are drawn
+class WaveformRenderer:
+    def __init__(self, ax, pyramid=None, **line_kwargs):
+        self.ax = ax
+        self.pyramid = None
+        self.line, = ax.plot([], [], **line_kwargs)
+        self._updating = False
+
+        # A lambda keeps this renderer alive for as long as the axis is
+        ax.callbacks.connect('xlim_changed', lambda changed_ax: self._on_xlim_changed())
+        if pyramid is not None:
+            self.set_pyramid(pyramid)
+
+    # Shows another waveform on the same line, resetting the view to the whole waveform
+    def set_pyramid(self, pyramid):
+        self.pyramid = pyramid
+        self._updating = True
+        try:
+            duration = pyramid.n_samples / pyramid.framerate
+            self.ax.set_xlim([0, duration])
+            low, high = pyramid.value_range()
+            if low < high:
+                self.ax.set_ylim([low, high])
+        finally:
+            self._updating = False
+        self.refresh()
+
+    # Recomputes the envelope for the current view
+    def refresh(self):
+        if self.pyramid is None:
+            return
+        start_time, stop_time = self.ax.get_xlim()
+        x, y = self.pyramid.envelope(start_time, stop_time, self.ax.bbox.width)
+        self.line.set_data(x, y)
+
+    # Zooming or panning redraws the envelope, changes made by set_pyramid are drawn by its caller
+    def _on_xlim_changed(self):
+        if self._updating:
+            return
+        self.refresh()
+        self.ax.figure.canvas.draw_idle()
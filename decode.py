@@ -0,0 +1,301 @@
+### This file holds the decoder for compressed audio (MP3 etc.). ffmpeg is run
+### directly and its PCM output is read from the pipe block by block and written
+### straight into a .npy file of the decoded audio cache (keyed by the content
+### hash of the source), which is then memory-mapped, so a decoded file is never
+### held in memory and analyzing it again skips decoding. Without the cache the
+### blocks are joined in memory (or in a scratch file, see wavreader.scratch_file).
+
+import glob
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import numpy as np
+import analysisindex
+import profiling
+import wavreader
+
+# Default location and size cap of the decoded PCM cache, both can be set with environment variables
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "spidam", "pcm")
+DEFAULT_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+# Frames read from ffmpeg at a time
+READ_BLOCK_FRAMES = 1 << 16
+
+
+class DecodeError(Exception):
+    pass
+
+
+# Path of the ffmpeg executable (SPIDAM_FFMPEG or ffmpeg on the PATH), None if there is none
+def find_ffmpeg():
+    return os.environ.get("SPIDAM_FFMPEG") or shutil.which("ffmpeg")
+
+
+def _read_exact(stream, size):
+    data = b''
+    while len(data) < size:
+        part = stream.read(size - len(data))
+        if not part:
+            break
+        data += part
+    return data
+
+
+# Reads the WAV header ffmpeg writes in front of the streamed PCM, returns (n_channels, framerate)
+# The sizes in a streamed header are placeholders, so the data simply runs until the pipe closes
+def _read_stream_header(stream):
+    riff = _read_exact(stream, 12)
+    if len(riff) < 12 or riff[:4] != b'RIFF' or riff[8:] != b'WAVE':
+        raise DecodeError("ffmpeg produced no audio")
+    fmt = None
+    while True:
+        header = _read_exact(stream, 8)
+        if len(header) < 8:
+            raise DecodeError("ffmpeg output has no data chunk")
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            break
+        data = _read_exact(stream, chunk_size + chunk_size % 2)
+        if chunk_id == b'fmt ':
+            fmt = data
+    if fmt is None:
+        raise DecodeError("ffmpeg output has no format chunk")
+    _, n_channels, framerate = struct.unpack('<HHI', fmt[:8])
+    return n_channels, framerate
+
+
+# Decodes a file with ffmpeg and returns (framerate, n_channels, blocks) where blocks yields
+# the 16-bit samples downmixed to mono, read straight from ffmpeg's output pipe
+def stream_pcm(file_path, block_frames=READ_BLOCK_FRAMES, ffmpeg=None):
+    ffmpeg = ffmpeg or find_ffmpeg()
+    if ffmpeg is None:
+        raise DecodeError("ffmpeg was not found, install it or set SPIDAM_FFMPEG")
+    process = subprocess.Popen(
+        [ffmpeg, "-nostdin", "-v", "error", "-i", file_path, "-vn", "-map_metadata", "-1",
+         "-acodec", "pcm_s16le", "-f", "wav", "-"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        n_channels, framerate = _read_stream_header(process.stdout)
+    except DecodeError as error:
+        process.kill()
+        _, stderr = process.communicate()
+        raise DecodeError(f"Could not decode {file_path}: {stderr.decode(errors='replace').strip() or error}")
+
+    def blocks():
+        buffer = np.empty((block_frames, n_channels), dtype='<i2')
+        view = memoryview(buffer).cast('B')
+        try:
+            while True:
+                # Fill the block (a pipe read can return less than asked for)
+                filled = 0
+                while filled < len(view):
+                    count = process.stdout.readinto(view[filled:])
+                    if not count:
+                        break
+                    filled += count
+                frames = filled // (2 * n_channels)
+                if frames:
+                    mono = wavreader.downmix(buffer[:frames], 2)
+                    # A mono block is a view of the reused buffer, so it is copied
+                    yield mono.copy() if n_channels == 1 else mono
+                if filled < len(view):
+                    break
+            stderr = process.stderr.read()
+            if process.wait() != 0:
+                raise DecodeError(f"Could not decode {file_path}: {stderr.decode(errors='replace').strip()}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    return framerate, n_channels, blocks()
+
+
+# Decodes a file with pydub, used when there is no ffmpeg executable (pydub can also use avconv)
+def decode_pydub(file_path):
+    from pydub import AudioSegment  # Imported here since pydub is slow to import
+
+    audio = AudioSegment.from_file(file_path)
+    samples = wavreader.bytes_to_mono(audio.raw_data, audio.channels, audio.sample_width)
+    return samples, audio.frame_rate, audio.channels
+
+
+# Writes 1D sample blocks one after another to a binary file, returns the number of samples
+def write_blocks(f, blocks, dtype):
+    count = 0
+    for block in blocks:
+        block = np.ascontiguousarray(block, dtype=dtype)
+        f.write(block.data)
+        count += len(block)
+    return count
+
+
+# Writes 1D sample blocks to a binary file as a .npy array, returns the number of samples
+# The header is written with length 0 and rewritten once the length is known (numpy leaves
+# room in the header for the length to grow), so the blocks never have to be joined in memory
+def write_npy(f, blocks, dtype):
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': (0,)}
+    np.lib.format.write_array_header_1_0(f, header)
+    data_offset = f.tell()
+    count = write_blocks(f, blocks, dtype)
+    f.seek(0)
+    header['shape'] = (count,)
+    np.lib.format.write_array_header_1_0(f, header)
+    if f.tell() != data_offset:
+        raise DecodeError("the .npy header changed size")
+    return count
+
+
+# Joins sample blocks into one array, written to a scratch file and memory-mapped if one is
+# configured (see wavreader.scratch_file), otherwise in memory
+def join_blocks(blocks, dtype):
+    f = wavreader.scratch_file()
+    if f is None:
+        parts = [np.asarray(block, dtype=dtype) for block in blocks]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=dtype)
+    with f:
+        count = write_blocks(f, blocks, dtype)
+        f.flush()
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(f, dtype=dtype, mode='r', shape=(count,))
+
+
+# Decoded mono PCM stored as .npy files named <content hash>-<framerate>hz-<channels>ch.npy,
+# with least recently used files removed once the directory exceeds max_bytes
+class PCMCache:
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    # Returns (memory-mapped samples, framerate, n_channels), or None if not cached
+    def load(self, content_hash):
+        for path in glob.glob(os.path.join(self.directory, f"{content_hash}-*hz-*ch.npy")):
+            try:
+                samples = np.load(path, mmap_mode='r')
+                os.utime(path)  # Marks the file as recently used
+            except (OSError, ValueError):
+                continue
+            framerate, n_channels = os.path.basename(path)[len(content_hash) + 1:-len("ch.npy")].split("hz-")
+            return samples, int(framerate), int(n_channels)
+        return None
+
+    # Writes sample blocks as they arrive (to a temporary file first, so readers never see a
+    # partial file) and returns the cached samples memory-mapped
+    def save(self, content_hash, blocks, framerate, n_channels, dtype=np.int16):
+        path = os.path.join(self.directory, f"{content_hash}-{framerate}hz-{n_channels}ch.npy")
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(handle, 'w+b') as f:
+                write_npy(f, blocks, dtype)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        samples = np.load(path, mmap_mode='r')
+        self.trim()
+        return samples
+
+    # Deletes the least recently used files until the cache fits its size cap
+    def trim(self):
+        with self._lock:
+            entries = []
+            for path in glob.glob(os.path.join(self.directory, "*.npy")):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, "*.npy")):
+            os.remove(path)
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+# Returns the shared PCM cache, configured with SPIDAM_PCM_CACHE_DIR and SPIDAM_PCM_CACHE_MAX_MB,
+# or None if it is disabled with SPIDAM_PCM_CACHE=0 or cannot be created
+def default_cache():
+    global _default_cache
+    if os.environ.get("SPIDAM_PCM_CACHE", "1") == "0":
+        return None
+    with _default_lock:
+        if _default_cache is None:
+            directory = os.environ.get("SPIDAM_PCM_CACHE_DIR", DEFAULT_CACHE_DIR)
+            max_bytes = int(float(os.environ.get("SPIDAM_PCM_CACHE_MAX_MB", DEFAULT_CACHE_MAX_BYTES / 2**20)) * 2**20)
+            try:
+                _default_cache = PCMCache(directory, max_bytes)
+            except OSError as error:
+                print(f"Warning: decoded audio cache disabled ({error})")
+                _default_cache = False
+        return _default_cache or None
+
+
+# Passes the blocks on, calling progress(None) before each one so a cancelled decode stops early
+def _report_blocks(blocks, progress):
+    for block in blocks:
+        progress(None)
+        yield block
+
+
+# Decodes a file with ffmpeg (or pydub) into the PCM cache, or without it when cache is None
+# (see join_blocks), and returns (mono samples, framerate, n_channels)
+def _decode(file_path, cache=None, content_hash=None, progress=None):
+    ffmpeg = find_ffmpeg()
+    with profiling.stage('decode.ffmpeg' if ffmpeg else 'decode.pydub'):
+        if ffmpeg:
+            framerate, n_channels, blocks = stream_pcm(file_path, ffmpeg=ffmpeg)
+            dtype = np.int16
+        else:
+            samples, framerate, n_channels = decode_pydub(file_path)
+            blocks, dtype = [samples], samples.dtype
+        if progress is not None:
+            blocks = _report_blocks(blocks, progress)
+        if cache is not None:
+            samples = cache.save(content_hash, blocks, framerate, n_channels, dtype)
+        else:
+            samples = join_blocks(blocks, dtype)
+    return samples, framerate, n_channels
+
+
+# Returns (mono samples, framerate, n_channels) of a compressed file, from the PCM cache if it
+# was decoded before, otherwise decoded with ffmpeg (or pydub) straight into the cache
+# index (an analysisindex.AnalysisIndex) avoids re-hashing files it has already seen
+# progress, if given, is called with the fraction done (None while decoding, the length of
+# the output is not known) and may raise to stop the decode
+def decode_file(file_path, index=None, cache=None, progress=None):
+    if cache is None:
+        cache = default_cache()
+    if cache is not None:
+        with profiling.stage('decode.hash'):
+            if index is not None:
+                content_hash = index.content_hash(file_path, progress)
+            else:
+                content_hash = analysisindex.hash_file(file_path, progress)
+        with profiling.stage('decode.pcm_cache'):
+            cached = cache.load(content_hash)
+        if cached is not None:
+            return cached
+        try:
+            return _decode(file_path, cache, content_hash, progress)
+        except OSError as error:
+            # The stream has been used up, so the file is decoded again without the cache
+            print(f"Warning: could not cache decoded audio of {file_path} ({error})")
+    return _decode(file_path, progress=progress)
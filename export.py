@@ -0,0 +1,303 @@
+### This file holds the analysis export. The spectrogram (STFT in dB) of a file
+### is written in tiles of quantized columns (uint8 with a scale per tile, or
+### float16), followed by the spectrum and a JSON footer with the duration,
+### resonant frequency, band peak tables and the position of every tile. The
+### writer streams tile by tile, so multi-hour files never hold their whole
+### spectrogram in memory, and the reader memory-maps the file so viewing an
+### export only reads the tiles that are shown and recomputes nothing.
+###
+### Layout: magic | tiles and arrays (each 64 byte aligned) | footer JSON | footer length (u64) | magic
+###
+### Examples:
+###   python export.py recording.wav -o recording.spx [--float16]
+###   python export.py --show recording.spx -o heatmap.png
+
+import argparse
+import json
+import os
+import struct
+import sys
+import numpy as np
+import analysiscore
+import analysiscache
+import bands
+import profiling
+import spectral
+
+MAGIC = b'SPIDAMX1'
+FORMAT_VERSION = 1
+
+# Spectrogram columns per tile, a tile is quantized and written as one block
+TILE_COLUMNS = 1024
+
+# Columns computed at a time by export_analysis
+STFT_CHUNK_COLUMNS = TILE_COLUMNS
+
+# uint8 tiles keep this many dB below the loudest value of the tile, anything quieter is stored as the floor
+UINT8_RANGE_DB = 120.0
+
+QUANTIZATIONS = ('uint8', 'float16')
+
+# Band sets whose peak tables are exported
+EXPORTED_BAND_SETS = ('basic', 'octave', 'third_octave')
+
+ALIGNMENT = 64
+
+
+class ExportError(Exception):
+    pass
+
+
+# Quantizes dB columns (columns x rows) for a tile, returns (data, offset, scale)
+# uint8 values map back to offset + value * scale, float16 values are stored as they are
+def quantize(columns_db, quantization):
+    if quantization == 'float16':
+        return columns_db.astype(np.float16), 0.0, 1.0
+    top = float(columns_db.max()) if columns_db.size else 0.0
+    bottom = max(float(columns_db.min()) if columns_db.size else 0.0, top - UINT8_RANGE_DB)
+    scale = (top - bottom) / 255 or 1.0
+    data = np.rint((np.maximum(columns_db, bottom) - bottom) / scale).astype(np.uint8)
+    return data, bottom, scale
+
+
+# Writes an export file, spectrogram columns are added in order with add_columns and
+# written as soon as a tile is full, so memory use does not depend on the file length
+class ExportWriter:
+    def __init__(self, file_path, n_rows, quantization='uint8', tile_columns=TILE_COLUMNS):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', choose from {QUANTIZATIONS}")
+        self.file_path = file_path
+        self.n_rows = n_rows
+        self.quantization = quantization
+        self.tile_columns = tile_columns
+        self.metadata = {}
+        self.arrays = {}
+        self.tiles = []
+        self.n_columns = 0
+        self._pending = []
+        self._pending_columns = 0
+        self._file = open(file_path, 'wb')
+        self._file.write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            os.remove(self.file_path)
+
+    # Writes bytes at the next aligned position and returns that position
+    def _write_block(self, data):
+        position = self._file.tell()
+        padding = -position % ALIGNMENT
+        self._file.write(b'\0' * padding)
+        self._file.write(data)
+        return position + padding
+
+    # Adds dB spectrogram columns, an array of shape (n_rows, k) like spectral.stft returns
+    def add_columns(self, heatmap_db):
+        if heatmap_db.shape[0] != self.n_rows:
+            raise ValueError(f"Expected {self.n_rows} rows, got {heatmap_db.shape[0]}")
+        # Stored time-major, so a run of columns is one contiguous block
+        self._pending.append(np.asarray(heatmap_db, dtype=np.float32).T)
+        self._pending_columns += heatmap_db.shape[1]
+        while self._pending_columns >= self.tile_columns:
+            self._flush_tile(self.tile_columns)
+
+    def _flush_tile(self, count):
+        pending = np.concatenate(self._pending) if len(self._pending) > 1 else self._pending[0]
+        tile, rest = pending[:count], pending[count:]
+        self._pending = [rest] if len(rest) else []
+        self._pending_columns = len(rest)
+        with profiling.stage('export.tile'):
+            data, offset, scale = quantize(tile, self.quantization)
+            position = self._write_block(data.tobytes())
+        self.tiles.append({'offset': position, 'columns': len(tile), 'db_offset': offset, 'db_scale': scale})
+        self.n_columns += len(tile)
+
+    # Adds a named array (e.g. the spectrum), stored with its own dtype
+    def add_array(self, name, array):
+        array = np.ascontiguousarray(array)
+        position = self._write_block(array.tobytes())
+        self.arrays[name] = {'offset': position, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    # Writes the last partial tile and the footer
+    def close(self):
+        if self._pending_columns:
+            self._flush_tile(self._pending_columns)
+        footer = json.dumps({
+            'version': FORMAT_VERSION,
+            'metadata': self.metadata,
+            'spectrogram': {'rows': self.n_rows, 'columns': self.n_columns, 'quantization': self.quantization,
+                            'tile_columns': self.tile_columns, 'tiles': self.tiles},
+            'arrays': self.arrays,
+        }).encode()
+        self._write_block(footer)
+        self._file.write(struct.pack('<Q', len(footer)) + MAGIC)
+        self._file.close()
+
+
+# Exports the analysis of one file (an analysiscache.AudioAnalysis): metadata, band peak tables,
+# the spectrum in dB (float16) and the full resolution spectrogram, computed chunk by chunk
+# progress, if given, is called with the fraction of the spectrogram done
+def export_analysis(analysis, file_path, quantization='uint8', window_size=spectral.DEFAULT_WINDOW_SIZE,
+                    hop_size=spectral.DEFAULT_HOP_SIZE, progress=None):
+    freq, _ = analysis.spectrum()
+    n_frames = spectral.frame_count(analysis.n_frames, window_size, hop_size)
+    with ExportWriter(file_path, window_size // 2 + 1, quantization) as writer:
+        writer.metadata = {
+            'source': os.path.basename(analysis.file_path or ""),
+            'duration': analysis.duration,
+            'framerate': analysis.framerate,
+            'n_channels': analysis.n_channels,
+            'resonant_frequency': float(analysiscore.clamp_resonant_frequency(analysis.peak_frequency(),
+                                                                               analysis.framerate)),
+            'peak_frequency': float(analysis.peak_frequency()),
+            'band_peaks': {band_set: {name: [float(peak_freq), float(peak_db)]
+                                      for name, (peak_freq, peak_db) in analysis.band_peaks(band_set).items()}
+                           for band_set in EXPORTED_BAND_SETS},
+            'window_size': window_size,
+            'hop_size': hop_size,
+            'spectrum_bin_hz': float(freq[1]) if len(freq) > 1 else 0.0,
+        }
+        writer.add_array('spectrum_db', analysis.spectrum_db().astype(np.float16))
+
+        for start in range(0, n_frames, STFT_CHUNK_COLUMNS):
+            stop = min(start + STFT_CHUNK_COLUMNS, n_frames)
+            samples = analysis.waveform[start * hop_size:(stop - 1) * hop_size + window_size]
+            with profiling.stage('export.stft'):
+                _, _, magnitude = spectral.stft(samples, analysis.framerate, window_size, hop_size,
+                                                dtype=analysis.dtype)
+            writer.add_columns(spectral.magnitude_to_db(magnitude))
+            if progress is not None:
+                progress(stop / n_frames)
+    return file_path
+
+
+# An export file opened for reading, the tiles and arrays are memory-mapped
+class ExportedAnalysis:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            if size < 2 * len(MAGIC) + 8 or f.read(len(MAGIC)) != MAGIC:
+                raise ExportError(f"{file_path} is not an analysis export")
+            f.seek(size - len(MAGIC) - 8)
+            footer_size, magic = struct.unpack('<Q8s', f.read(8 + len(MAGIC)))
+            if magic != MAGIC:
+                raise ExportError(f"{file_path} is incomplete (no footer)")
+            f.seek(size - len(MAGIC) - 8 - footer_size)
+            footer = json.loads(f.read(footer_size))
+        if footer['version'] > FORMAT_VERSION:
+            raise ExportError(f"{file_path} was written by a newer version (format {footer['version']})")
+
+        self.metadata = footer['metadata']
+        self.arrays = footer['arrays']
+        spectrogram = footer['spectrogram']
+        self.n_rows = spectrogram['rows']
+        self.n_columns = spectrogram['columns']
+        self.quantization = spectrogram['quantization']
+        self.tiles = spectrogram['tiles']
+        self.tile_columns = spectrogram['tile_columns']
+        self._data = np.memmap(file_path, dtype=np.uint8, mode='r')
+
+    @property
+    def duration(self):
+        return self.metadata['duration']
+
+    @property
+    def framerate(self):
+        return self.metadata['framerate']
+
+    @property
+    def resonant_frequency(self):
+        return self.metadata['resonant_frequency']
+
+    # Peak (frequency, dB value) of every band of an exported band set
+    def band_peaks(self, band_set=bands.DEFAULT_BAND_SET):
+        return {name: tuple(peak) for name, peak in self.metadata['band_peaks'][band_set].items()}
+
+    # A stored array as a read-only memory-mapped view
+    def array(self, name):
+        entry = self.arrays[name]
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape']))
+        return self._data[entry['offset']:entry['offset'] + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+
+    # The spectrum as (freq, dB), like AudioAnalysis.spectrum_db with its frequency grid
+    def spectrum_db(self):
+        values = self.array('spectrum_db')
+        return np.arange(len(values)) * self.metadata['spectrum_bin_hz'], values
+
+    def frequencies(self):
+        return np.fft.rfftfreq(self.metadata['window_size'], d=1 / self.framerate)
+
+    def column_times(self, columns):
+        return np.asarray(columns) * self.metadata['hop_size'] / self.framerate
+
+    # The stored (still quantized) columns of tile i, shape (columns, rows)
+    def _tile(self, i):
+        tile = self.tiles[i]
+        dtype = np.uint8 if self.quantization == 'uint8' else np.float16
+        size = tile['columns'] * self.n_rows * np.dtype(dtype).itemsize
+        return self._data[tile['offset']:tile['offset'] + size].view(dtype).reshape(tile['columns'], self.n_rows)
+
+    # Spectrogram columns [start, stop) in dB as float32 of shape (rows, columns), only the tiles
+    # covering that range are read
+    def columns(self, start=0, stop=None):
+        stop = self.n_columns if stop is None else min(stop, self.n_columns)
+        start = max(0, start)
+        result = np.empty((self.n_rows, max(0, stop - start)), dtype=np.float32)
+        for i in range(start // self.tile_columns, -(-stop // self.tile_columns)):
+            first = i * self.tile_columns
+            low, high = max(start, first) - first, min(stop, first + self.tiles[i]['columns']) - first
+            values = self._tile(i)[low:high].astype(np.float32)
+            values = values * self.tiles[i]['db_scale'] + self.tiles[i]['db_offset']
+            result[:, first + low - start:first + high - start] = values.T
+        return result
+
+    # Overview of the whole spectrogram as (freq, time, heatmap_db) like AudioAnalysis.stft, with
+    # runs of columns merged (keeping the loudest value) to at most max_columns, read tile by tile
+    def heatmap(self, max_columns=analysiscache.MAX_HEATMAP_COLUMNS):
+        group = max(1, -(-self.n_columns // max_columns))
+        heatmap = np.full((self.n_rows, -(-self.n_columns // group)), -np.inf, dtype=np.float32)
+        for i, tile in enumerate(self.tiles):
+            # Every tile but the last is full, so tile i starts at column i * tile_columns
+            first = i * self.tile_columns
+            values = self.columns(first, first + tile['columns'])
+            groups = (first + np.arange(tile['columns'])) // group
+            starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+            # A group can continue from the previous tile, so the tile is merged into what is there
+            targets = groups[starts]
+            heatmap[:, targets] = np.maximum(heatmap[:, targets], np.maximum.reduceat(values, starts, axis=1))
+        return self.frequencies(), self.column_times(np.arange(heatmap.shape[1]) * group), heatmap
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export analysis results in a compact binary format.")
+    parser.add_argument("file", help="audio file to export, or an export file with --show")
+    parser.add_argument("-o", "--output", required=True, help="export file (or image file with --show)")
+    parser.add_argument("--float16", action="store_true", help="store the spectrogram as float16 instead of uint8")
+    parser.add_argument("--show", action="store_true", help="render the heatmap of an export file")
+    args = parser.parse_args(argv)
+
+    if args.show:
+        import plotsurface
+
+        exported = ExportedAnalysis(args.file)
+        plotsurface.view_figure(plotsurface.HeatmapView, *exported.heatmap()).savefig(args.output)
+        return 0
+
+    analysis = analysiscache.AudioAnalysis.from_file(args.file)
+    export_analysis(analysis, args.output, 'float16' if args.float16 else 'uint8',
+                    progress=lambda fraction: print(f"\rExporting... {fraction:.0%}", end="", file=sys.stderr))
+    print(file=sys.stderr)
+    print(f"{args.output}: {os.path.getsize(args.output) / 2**20:.1f} MB", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,102 +1,201 @@
 ### This file holds the programming to design and create the GUI
-### as well as import the audio file into the GUI and convert
-### it to the correct format before cleaning it.
+### as well as import the audio file into the GUI and decode
+### it into memory for analysis.
 
 #Import packages
+import math
 import tkinter as tk
 from tkinter import filedialog
-from pydub import AudioSegment
-import wave
-from mutagen.mp3 import MP3
+import analysiscache
+import profiling
+import tasks
 # Define a global variable to store the file path
 selected_file_path = ""
 
+# The files of the current comparison (see Compare Files)
+selected_file_paths = []
+
 # Define function for user to select file from their system
 def select_file():
     global selected_file_path
     file_path = filedialog.askopenfilename(filetypes=[("Audio Files", "*.wav *.mp3")])
     if file_path:
+        # Work for the previous file is no longer needed, an export or comparison keeps running
+        scheduler.cancel('file', 'plot', 'reverb')
         selected_file_path = file_path
         file_name = file_path.split("/")[-1]
         nameLabel.config(text=f"Selected file: {file_name}")
-        process_audio(file_path)
+        duration_label.config(text="")
+        frequency_label.config(text="")
+        scheduler.submit('file', process_audio, file_path, on_done=show_audio_info, on_error=show_error)
         root.geometry("800x800")
 
-# Define function to process the audio file and convert to .wav if necessary
-def process_audio(file_path):
-    # Convert to .wav if not already
-    if file_path.endswith(".mp3"):
-        # Save audio from selected file in audio variable
-        audio = AudioSegment.from_file(file_path)
-
-        # Remove metadata from audio file if file is mp3
-        mp3 = MP3(file_path)
-        mp3.delete()
-        mp3.save()
-
-        # Continue .wav conversion
-        file_path = file_path.rsplit(".", 1)[0] + ".wav"
-        audio.export(file_path, format="wav")
-
-    # Open the .wav file
-    with wave.open(file_path, 'rb') as wav_file:
-        #Get parameters for current and future calculations
-        params = wav_file.getparams()
-        n_channels, sampwidth, framerate, n_frames, comptype, compname = params[:6]
-
-        # Convert to single channel if not already
-        if n_channels > 1:
-            audio = AudioSegment.from_wav(file_path)
-            audio = audio.set_channels(1)
-            audio.export(file_path, format="wav")
-
-        # Calculate duration of file in seconds
-        duration = n_frames / float(framerate)
-
-        # Display duration
-        duration_label.config(text=f"Duration: {duration:.2f} seconds")
-
-# Create the main window
-root = tk.Tk()
-root.title("Audio Wave Analyzer")
-root.geometry("800x600")  # Adjusted window size
-root.configure(bg='#f0f0f0')
-
-# Create a label to display the selected file name
-nameLabel = tk.Label(root, text="No file selected", bg='#f0f0f0', font=("Arial", 12))
-nameLabel.grid(pady=10, padx=10, column=0, row=0, columnspan=2)
-
-# Create a button to open the file dialog
-select_button = tk.Button(root, text="Select Audio File", command=select_file, font=("Arial", 12))
-select_button.grid(pady=10, padx=10, column=0, row=1, columnspan=2)
-
-# Create a label to display the duration of the audio file
-duration_label = tk.Label(root, text="", bg='#f0f0f0', font=("Arial", 12))
-duration_label.grid(pady=10, padx=10, column=0, row=2, columnspan=2)
-
-# Create a canvas for plotting
-plot_canvas = tk.Canvas(root, width=600, height=400, bg='white', highlightthickness=1, highlightbackground="black")
-plot_canvas.grid(pady=10, padx=10, column=0, row=3, columnspan=2)
-
-# Create a label to display the resonance frequencies below the plot
-frequency_label = tk.Label(root, text="", bg='#f0f0f0', font=("Arial", 12))
-frequency_label.grid(pady=10, padx=10, column=0, row=4, columnspan=2, sticky="w")
-
-# Create a button to plot wav file
-plot_button = tk.Button(root, text="Plot Waveform", font=("Arial", 12))
-plot_button.grid(pady=10, padx=10, column=0, row=5)
-
-# Create a button to swap between plots
-three_plot_button = tk.Button(root, text="Swap Between Low, Mid, High Freq.", font=("Arial", 12))
-three_plot_button.grid(pady=10, padx=10, column=1, row=5)
-
-# Create a button to combine plots
-combine_plot_button = tk.Button(root, text="Combine Plots", font=("Arial", 12))
-combine_plot_button.grid(pady=10, padx=10, column=0, row=6)
-
-# Add the 'Other Action' button
-other_button = tk.Button(root, text="Plot Intensity", font=("Arial", 12))
-other_button.grid(pady=10, padx=10, column=1, row=6)
+# Define function to load the audio file for analysis
+# Nothing is written to disk: WAV files are memory-mapped and MP3 files decoded in memory,
+# stereo is downmixed to mono with NumPy (see analysiscache.AudioAnalysis.from_file)
+# This runs on a worker thread (see tasks.py) so it must not touch any widgets
+def process_audio(task, file_path):
+    task.progress(None, "Decoding audio")
+    analysis = analysiscache.get_analysis(file_path, task.progress)
+
+    # Start the analysis now so the first plot is ready sooner
+    task.progress(None, "Analyzing")
+    analysis.spectrum(progress=task.progress)
+
+    return file_path, analysis.duration
+
+# Runs on the main thread once process_audio has finished
+def show_audio_info(result):
+    global selected_file_path
+    selected_file_path, duration = result
+
+    # Display duration
+    duration_label.config(text=f"Duration: {duration:.2f} seconds")
+
+    show_timings()
+
+    # The reverberation times follow once they are computed
+    scheduler.submit('reverb', process_reverb, selected_file_path, on_done=show_reverb, on_error=show_error)
+
+# Computes the RT60 of the low, mid and high bands, runs on a worker thread
+def process_reverb(task, file_path):
+    task.progress(0, "Measuring reverberation")
+    return analysiscache.get_analysis(file_path, task.progress).decay_times(progress=task.progress)
+
+# Shows the reverberation times below the plot
+def show_reverb(times):
+    parts = [f"{band.capitalize()}: n/a" if math.isnan(values['rt60'])
+             else f"{band.capitalize()}: {values['rt60']:.2f} s" for band, values in times.items()]
+    frequency_label.config(text="RT60  " + "   ".join(parts))
+    show_timings()
+
+# Shows an error from a background task
+def show_error(error):
+    status_label.config(text=f"Error: {error}")
+
+# Shows the progress of background tasks in the status bar
+def show_progress(channel, fraction, message):
+    global status_message
+    if channel is None or (fraction is None and message is None):
+        status_message = ""
+        status_label.config(text="")
+        return
+    if message is not None:
+        status_message = message
+    if fraction is None:
+        status_label.config(text=f"{status_message}...")
+    else:
+        status_label.config(text=f"{status_message}... {fraction:.0%}")
+
+# Shows how long the stages since the last readout took, only while tracing is on (see profiling.py)
+def show_timings():
+    summary = profiling.recent_summary()
+    if summary:
+        timing_label.config(text=summary)
+
+# The window and its widgets, created by build_window
+root = None
+nameLabel = None
+select_button = None
+duration_label = None
+plot_canvas = None
+frequency_label = None
+plot_button = None
+three_plot_button = None
+combine_plot_button = None
+other_button = None
+compare_button = None
+compare_view_button = None
+export_button = None
+status_label = None
+timing_label = None
+scheduler = None
+status_message = ""
+
+# The figure and Tk canvas drawn inside plot_canvas, created with the first plot and then reused
+plot_surface = None
+
+# Builds the main window, this is not done on import so the analysis modules (and this one)
+# can be imported without a display and the window appears before matplotlib is loaded
+def build_window():
+    global root, nameLabel, select_button, duration_label, plot_canvas, frequency_label, plot_button
+    global three_plot_button, combine_plot_button, other_button, compare_button, compare_view_button, export_button
+    global status_label, timing_label, scheduler
+
+    # Create the main window
+    root = tk.Tk()
+    root.title("Audio Wave Analyzer")
+    root.geometry("800x600")  # Adjusted window size
+    root.configure(bg='#f0f0f0')
+
+    # Create a label to display the selected file name
+    nameLabel = tk.Label(root, text="No file selected", bg='#f0f0f0', font=("Arial", 12))
+    nameLabel.grid(pady=10, padx=10, column=0, row=0, columnspan=2)
+
+    # Create a button to open the file dialog
+    select_button = tk.Button(root, text="Select Audio File", command=select_file, font=("Arial", 12))
+    select_button.grid(pady=10, padx=10, column=0, row=1, columnspan=2)
+
+    # Create a label to display the duration of the audio file
+    duration_label = tk.Label(root, text="", bg='#f0f0f0', font=("Arial", 12))
+    duration_label.grid(pady=10, padx=10, column=0, row=2, columnspan=2)
+
+    # Create a canvas for plotting
+    plot_canvas = tk.Canvas(root, width=600, height=400, bg='white', highlightthickness=1, highlightbackground="black")
+    plot_canvas.grid(pady=10, padx=10, column=0, row=3, columnspan=2)
+
+    # Create a label to display the resonance frequencies below the plot
+    frequency_label = tk.Label(root, text="", bg='#f0f0f0', font=("Arial", 12))
+    frequency_label.grid(pady=10, padx=10, column=0, row=4, columnspan=2, sticky="w")
+
+    # Create a button to plot wav file
+    plot_button = tk.Button(root, text="Plot Waveform", font=("Arial", 12))
+    plot_button.grid(pady=10, padx=10, column=0, row=5)
+
+    # Create a button to swap between plots
+    three_plot_button = tk.Button(root, text="Swap Between Low, Mid, High Freq.", font=("Arial", 12))
+    three_plot_button.grid(pady=10, padx=10, column=1, row=5)
+
+    # Create a button to combine plots
+    combine_plot_button = tk.Button(root, text="Combine Plots", font=("Arial", 12))
+    combine_plot_button.grid(pady=10, padx=10, column=0, row=6)
+
+    # Add the 'Other Action' button
+    other_button = tk.Button(root, text="Plot Intensity", font=("Arial", 12))
+    other_button.grid(pady=10, padx=10, column=1, row=6)
+
+    # Create a button to compare several files
+    compare_button = tk.Button(root, text="Compare Files", font=("Arial", 12))
+    compare_button.grid(pady=10, padx=10, column=0, row=7)
+
+    # Create a button to swap between the comparison plots
+    compare_view_button = tk.Button(root, text="Swap Comparison View", font=("Arial", 12))
+    compare_view_button.grid(pady=10, padx=10, column=1, row=7)
+
+    # Create a button to export the analysis of the selected file
+    export_button = tk.Button(root, text="Export Analysis", font=("Arial", 12))
+    export_button.grid(pady=10, padx=10, column=0, row=8, columnspan=2)
+
+    # Create a status bar showing the progress of background work
+    status_label = tk.Label(root, text="", bg='#f0f0f0', font=("Arial", 10), anchor="w")
+    status_label.grid(pady=5, padx=10, column=0, row=9, columnspan=2, sticky="we")
+
+    # Create a second status line with the stage timings, only shown while tracing is on
+    timing_label = tk.Label(root, text="", bg='#f0f0f0', font=("Arial", 9), anchor="w", fg='#555555')
+    if profiling.enabled():
+        timing_label.grid(pady=0, padx=10, column=0, row=10, columnspan=2, sticky="we")
+
+    # Runs decoding and analysis off the Tk mainloop so the window stays responsive
+    scheduler = tasks.TaskScheduler(root, on_progress=show_progress)
+
+    # matplotlib is loaded in the background once the window is up, so the first plot is not slowed down
+    root.after_idle(scheduler.submit, 'preload', preload_plotting)
+    return root
+
+# Imports the plotting modules, runs on a worker thread after the window has appeared
+def preload_plotting(task):
+    import plotsurface
+    import matplotlib.backends.backend_tkagg
 
 # Remove the root.mainloop() call from here, assuming it's handled elsewhere in your application
 #Comment made to ensure proper files are sent over
\ No newline at end of file
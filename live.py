@@ -0,0 +1,326 @@
+### This file holds the live analysis mode. PCM blocks (from a WAV file that is
+### still being written, a raw PCM pipe, or a test signal standing in for an
+### input device) go into a fixed-size ring buffer, every new hop of samples
+### adds one spectrogram column and updates the band peaks, and the Tk canvas
+### is refreshed at a capped frame rate by updating the existing plot artists.
+###
+### Examples:
+###   python live.py --follow recording.wav
+###   arecord -f S16_LE -r 44100 -c 1 -t raw | python live.py --pipe --rate 44100
+###   python live.py --demo
+
+import argparse
+import os
+import sys
+import threading
+import time
+import numpy as np
+from matplotlib.figure import Figure
+import bands
+import spectral
+import wavreader
+
+# Seconds of spectrogram (and samples) kept
+DEFAULT_HISTORY_SECONDS = 10.0
+
+# Frames per block read from a source
+DEFAULT_BLOCK_FRAMES = 1024
+
+# The canvas is redrawn at most this many times per second
+MAX_FPS = 20
+
+# dB range shown by the live plots (matches the heatmap)
+DB_RANGE = (0, 100)
+
+
+# Fixed-size buffer of the most recent samples
+# Every sample is stored twice, so the newest n samples are always one contiguous view
+class RingBuffer:
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = capacity
+        self._data = np.zeros(2 * capacity, dtype=dtype)
+        self._end = 0
+        self.total = 0  # Samples written so far
+
+    def write(self, block):
+        block = np.asarray(block)
+        self.total += len(block)
+        block = block[-self.capacity:]  # Older samples would be overwritten anyway
+        first = min(len(block), self.capacity - self._end)
+        rest = len(block) - first
+        for offset in (0, self.capacity):
+            self._data[offset + self._end:offset + self._end + first] = block[:first]
+            self._data[offset:offset + rest] = block[first:]
+        self._end = (self._end + len(block)) % self.capacity
+
+    # The newest n samples, oldest first (a view, valid until the next write)
+    def latest(self, n):
+        n = min(n, self.capacity, self.total)
+        return self._data[self._end + self.capacity - n:self._end + self.capacity]
+
+
+# Incremental STFT of a live signal: each new hop of samples costs one window-sized rfft
+class LiveAnalyzer:
+    def __init__(self, framerate, window_size=spectral.DEFAULT_WINDOW_SIZE, hop_size=spectral.DEFAULT_HOP_SIZE,
+                 history_seconds=DEFAULT_HISTORY_SECONDS, band_set=bands.DEFAULT_BAND_SET, dtype=np.float32):
+        self.framerate = framerate
+        self.window_size = window_size
+        self.hop_size = hop_size
+        self.history_seconds = history_seconds
+        self.buffer = RingBuffer(max(2 * window_size, int(history_seconds * framerate)), dtype)
+        self.freq = np.fft.rfftfreq(window_size, d=1 / framerate)
+
+        # Spectrogram columns in dB, also a ring: column self._column is the next one written
+        self.n_columns = max(1, int(history_seconds * framerate / hop_size))
+        self.spectrogram = np.zeros((len(self.freq), self.n_columns), dtype=dtype)
+        self._column = 0
+
+        self._window = spectral.get_window('hann', window_size, dtype)
+        self._layout = bands.band_layout(self.freq, band_set)
+        self.band_names = self._layout.names
+        self.peak_hold = np.full(len(self.freq), -np.inf)
+        self.band_peaks = {}
+        self.band_peak_hold = {}
+
+        self.frames = 0  # Analyzed frames, frame k covers samples [k * hop, k * hop + window)
+        self.version = 0  # Incremented whenever new columns are added
+        self._lock = threading.Lock()
+
+    # Adds a block of mono samples and analyzes every frame it completes
+    def push(self, block):
+        block = np.asarray(block)
+        # Pieces are kept small enough that the samples of pending frames are still buffered
+        step = self.buffer.capacity - self.window_size
+        with self._lock:
+            for start in range(0, len(block), step):
+                self.buffer.write(block[start:start + step])
+                self._analyze()
+
+    def _analyze(self):
+        available = (self.buffer.total - self.window_size) // self.hop_size + 1
+        if available <= self.frames:
+            return
+        first_sample = self.frames * self.hop_size
+        samples = self.buffer.latest(self.buffer.total - first_sample)
+        frames = spectral.frame_view(samples, self.window_size, self.hop_size)[:available - self.frames]
+        columns = spectral.magnitude_to_db(np.abs(np.fft.rfft(frames * self._window, axis=1))).T
+
+        # Write the new columns into the ring, wrapping around at the end
+        positions = (self._column + np.arange(columns.shape[1])) % self.n_columns
+        self.spectrogram[:, positions] = columns
+        self._column = (positions[-1] + 1) % self.n_columns
+
+        np.maximum(self.peak_hold, columns.max(axis=1), out=self.peak_hold)
+        self.band_peaks = self._layout.peaks(self.freq, columns[:, -1])
+        self.band_peak_hold = self._layout.peaks(self.freq, self.peak_hold)
+        self.frames = available
+        self.version += 1
+
+    # Clears the peak hold
+    def reset_peaks(self):
+        with self._lock:
+            self.peak_hold.fill(-np.inf)
+            self.band_peak_hold = {}
+
+    # Consistent copy of what the view draws: (version, spectrogram oldest column first,
+    # band peaks, band peak hold)
+    def snapshot(self):
+        with self._lock:
+            ordered = np.concatenate([self.spectrogram[:, self._column:], self.spectrogram[:, :self._column]], axis=1)
+            return self.version, ordered, dict(self.band_peaks), dict(self.band_peak_hold)
+
+
+# Live spectrogram and band level plots, built once and then only updated
+class LiveView:
+    def __init__(self, figure, analyzer):
+        self.figure = figure
+        self.names = list(analyzer.band_names)
+        spectrogram_ax = figure.add_subplot(211)
+        bands_ax = figure.add_subplot(212)
+
+        self.image = spectrogram_ax.imshow(
+            np.zeros_like(analyzer.spectrogram), aspect='auto', cmap='autumn_r', origin='lower',
+            extent=[-analyzer.history_seconds, 0, analyzer.freq[0], analyzer.freq[-1]],
+            vmin=DB_RANGE[0], vmax=DB_RANGE[1])
+        spectrogram_ax.set_title("Live Frequency Heatmap")
+        spectrogram_ax.set_xlabel("Time (s)")
+        spectrogram_ax.set_ylabel("Frequency (Hz)")
+
+        x = np.arange(len(self.names))
+        colors = [bands.BAND_COLORS.get(name, 'gray') for name in self.names]
+        self.bars = bands_ax.bar(x, np.zeros(len(x)), color=colors)
+        self.hold, = bands_ax.plot(x, np.zeros(len(x)), linestyle='none', marker='_', markersize=30, color='black')
+        bands_ax.set_xticks(x, [name.capitalize() for name in self.names])
+        bands_ax.set_ylim(DB_RANGE[0], DB_RANGE[1] + 60)
+        bands_ax.set_ylabel("Peak (dB)")
+        figure.tight_layout(pad=2)
+
+    def update(self, spectrogram, band_peaks, band_peak_hold):
+        self.image.set_data(spectrogram)
+        for bar, name in zip(self.bars, self.names):
+            bar.set_height(band_peaks.get(name, (0, 0))[1])
+        self.hold.set_ydata([band_peak_hold.get(name, (0, np.nan))[1] for name in self.names])
+
+
+# Runs a live analysis in a Tk widget: a reader thread pushes the source blocks into the
+# analyzer, and the mainloop redraws the view at most MAX_FPS times per second
+class LiveSession:
+    def __init__(self, root, master, blocks, framerate, **analyzer_options):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.root = root
+        self.analyzer = LiveAnalyzer(framerate, **analyzer_options)
+        self.figure = Figure(figsize=(6, 5))
+        self.view = LiveView(self.figure, self.analyzer)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.canvas.get_tk_widget().pack(fill='both', expand=True)
+        self.canvas.draw()
+
+        self.error = None
+        self.finished = False
+        self._drawn_version = -1
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read, args=(blocks,), daemon=True)
+        self._thread.start()
+        self.root.after(1000 // MAX_FPS, self._refresh)
+
+    def _read(self, blocks):
+        try:
+            for block in blocks:
+                if self._stop.is_set():
+                    break
+                self.analyzer.push(block)
+        except Exception as error:
+            self.error = error
+        finally:
+            self.finished = True
+
+    def _refresh(self):
+        if self._stop.is_set():
+            return
+        # Read before the snapshot, so the last blocks of a finished source are still drawn
+        finished = self.finished
+        version, spectrogram, band_peaks, band_peak_hold = self.analyzer.snapshot()
+        if version != self._drawn_version:
+            self.view.update(spectrogram, band_peaks, band_peak_hold)
+            self.canvas.draw_idle()
+            self._drawn_version = version
+        if finished:
+            self._finish()
+            return
+        self.root.after(1000 // MAX_FPS, self._refresh)
+
+    # Stops refreshing once the source has ended and says why in the window title,
+    # a read error is also printed
+    def _finish(self):
+        self._stop.set()
+        if self.error is not None:
+            print(f"Live input stopped: {type(self.error).__name__}: {self.error}", file=sys.stderr)
+            self.root.title(f"{self.root.title()} - error: {self.error}")
+        else:
+            self.root.title(f"{self.root.title()} - input ended")
+
+    def stop(self):
+        self._stop.set()
+
+
+# Returns (framerate, blocks) reading a WAV file from the start and, with follow, waiting
+# for more data while it is being written until it stops growing for idle_timeout seconds
+# With realtime the blocks are paced like a live input
+def wav_source(file_path, block_frames=DEFAULT_BLOCK_FRAMES, follow=True, idle_timeout=2.0, realtime=False):
+    reader = wavreader.WavReader(file_path)
+    framerate = reader.framerate
+    header = (reader.data_offset, reader.block_align, reader.n_channels, reader.sampwidth, reader.format_tag)
+    reader.close()
+
+    def blocks():
+        data_offset, block_align, n_channels, sampwidth, format_tag = header
+        block_bytes = block_frames * block_align
+        idle_since = time.monotonic()
+        with open(file_path, 'rb') as f:
+            f.seek(data_offset)
+            pending = b''
+            while True:
+                pending += f.read(block_bytes - len(pending))
+                if len(pending) == block_bytes:
+                    yield wavreader.bytes_to_mono(pending, n_channels, sampwidth, format_tag)
+                    pending = b''
+                    idle_since = time.monotonic()
+                    if realtime:
+                        time.sleep(block_frames / framerate)
+                elif not follow or time.monotonic() - idle_since > idle_timeout:
+                    whole = len(pending) // block_align * block_align
+                    if whole:
+                        yield wavreader.bytes_to_mono(pending[:whole], n_channels, sampwidth, format_tag)
+                    return
+                else:
+                    time.sleep(0.02)
+
+    return framerate, blocks()
+
+
+# Returns (framerate, blocks) reading raw interleaved little-endian PCM from a binary stream (a pipe)
+def pcm_source(stream, framerate, n_channels=1, sampwidth=2, block_frames=DEFAULT_BLOCK_FRAMES):
+    def blocks():
+        block_bytes = block_frames * n_channels * sampwidth
+        while True:
+            data = stream.read(block_bytes)
+            whole = len(data) // (n_channels * sampwidth) * n_channels * sampwidth
+            if whole:
+                yield wavreader.bytes_to_mono(data[:whole], n_channels, sampwidth)
+            if len(data) < block_bytes:
+                return
+    return framerate, blocks()
+
+
+# Returns (framerate, blocks) of a slow sine sweep with noise, paced in real time,
+# standing in for an input device
+def tone_source(framerate=44100, block_frames=DEFAULT_BLOCK_FRAMES, seconds=None):
+    def blocks():
+        rng = np.random.default_rng()
+        phase = 0.0
+        start = time.monotonic()
+        n = 0
+        while seconds is None or n < seconds * framerate:
+            t = (n + np.arange(block_frames)) / framerate
+            freq = 1000 + 900 * np.sin(2 * np.pi * t / 8)  # Sweeps between 100 and 1900 Hz
+            phases = phase + 2 * np.pi * np.cumsum(freq) / framerate
+            phase = phases[-1]
+            yield (8000 * np.sin(phases) + 300 * rng.standard_normal(block_frames)).astype(np.int16)
+            n += block_frames
+            time.sleep(max(0.0, start + n / framerate - time.monotonic()))
+    return framerate, blocks()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Live spectrogram and band peaks.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--follow", metavar="WAV", help="WAV file to read, waiting for new data while it is written")
+    source.add_argument("--pipe", action="store_true", help="read raw little-endian PCM from standard input")
+    source.add_argument("--demo", action="store_true", help="use a generated test signal")
+    parser.add_argument("--rate", type=int, default=44100, help="sample rate of --pipe input")
+    parser.add_argument("--channels", type=int, default=1, help="channels of --pipe input")
+    parser.add_argument("--width", type=int, default=2, choices=(1, 2, 3, 4), help="bytes per sample of --pipe input")
+    parser.add_argument("--bands", default=bands.DEFAULT_BAND_SET, choices=sorted(bands.BAND_SETS), help="band set")
+    parser.add_argument("--history", type=float, default=DEFAULT_HISTORY_SECONDS, help="seconds shown")
+    args = parser.parse_args(argv)
+
+    if args.follow:
+        if not os.path.exists(args.follow):
+            parser.error(f"{args.follow} does not exist")
+        framerate, blocks = wav_source(args.follow, realtime=True)
+    elif args.pipe:
+        framerate, blocks = pcm_source(sys.stdin.buffer, args.rate, args.channels, args.width)
+    else:
+        framerate, blocks = tone_source()
+
+    import tkinter as tk
+    root = tk.Tk()
+    root.title("Live Audio Analyzer")
+    session = LiveSession(root, root, blocks, framerate, history_seconds=args.history, band_set=args.bands)
+    root.protocol("WM_DELETE_WINDOW", lambda: (session.stop(), root.destroy()))
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
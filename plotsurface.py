@@ -0,0 +1,394 @@
+### This file holds the persistent plotting surface. Instead of building a new
+### Figure and Tk canvas for every click, one canvas is kept and every view
+### (waveform, band spectrum, combined spectrum, heatmap) builds its axes and
+### artists once; switching views only swaps the data of those artists. The
+### rendered background of each view is cached and overlays such as the peak
+### markers are blitted on top of it. The Compare views draw a whole set of
+### files (see comparison.py) with one artist each, however many files there are.
+
+import weakref
+import numpy as np
+from matplotlib import colormaps
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+import bands
+import decimation
+import profiling
+
+# Figure size (inches) of the plot canvas
+FIGURE_SIZE = (6, 4)
+
+# Rendered backgrounds kept per view (about 1 MB each), e.g. one for each of low/mid/high
+BACKGROUNDS_PER_VIEW = 4
+
+# Files named in the legend (or on the axis) of a comparison, the others are drawn unlabeled
+MAX_LABELED_FILES = 12
+
+# Empty pixels between the tiles of the heatmap comparison
+TILE_GAP = 2
+
+
+# Base class of the views: the axes and artists of one kind of plot on a shared figure
+# Subclasses create their artists in __init__ and update them in set_data, which
+# returns a tuple of the objects drawn so a cached background can be reused
+class PlotView:
+    def __init__(self, figure, blit=False):
+        self.figure = figure
+        self.blit = blit
+        self.axes = []
+        self.overlays = []  # Artists drawn on top of the cached background
+        self.positions = None  # Axes positions found by tight_layout, set by PlotSurface
+
+    # Creates an overlay artist, animated ones are left out of full draws and blitted instead
+    def overlay(self, artist):
+        artist.set_animated(self.blit)
+        self.overlays.append(artist)
+        return artist
+
+    def set_visible(self, visible):
+        for ax in self.axes:
+            ax.set_visible(visible)
+
+    def set_data(self, *args):
+        raise NotImplementedError
+
+    def draw_overlays(self):
+        for artist in self.overlays:
+            if artist.get_visible():
+                artist.axes.draw_artist(artist)
+
+
+# Waveform drawn from the min/max pyramid of an analysis
+class WaveformView(PlotView):
+    def __init__(self, figure, blit=False, color=None, grid=False):
+        super().__init__(figure, blit)
+        ax = figure.add_subplot(111)
+        self.axes = [ax]
+        self.renderer = decimation.WaveformRenderer(ax, **({'color': color} if color else {}))
+        ax.set_title("Waveform")
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Amplitude")
+        ax.grid(grid)
+
+    def set_data(self, analysis):
+        self.renderer.set_pyramid(analysis.waveform_pyramid())
+        return (analysis,)
+
+
+# Spectrum of one band (plot_type is a band name) or of all bands (plot_type 'all'),
+# with a marker on the peak of each band, plotted against 1 / frequency like the original plots
+class SpectrumView(PlotView):
+    def __init__(self, figure, blit=False):
+        super().__init__(figure, blit)
+        ax = figure.add_subplot(111)
+        self.axes = [ax]
+        self.line, = ax.plot([], [], color='blue')  # Frequency spectrum line
+        ax.set_xlabel("Time (s)")  # Time on x-axis (converted from frequency)
+        ax.set_ylabel("Power (dB)")  # Power in dB on y-axis
+        ax.grid(True)
+        self.markers = {}
+
+    # The peak marker of a band, created the first time the band is shown
+    def marker(self, name):
+        if name not in self.markers:
+            self.markers[name], = self.axes[0].plot([], [], linestyle='none', marker='o', markersize=10,
+                                                    color=bands.BAND_COLORS.get(name, 'black'),
+                                                    label=f"Peak {name.capitalize()} Frequency")
+            self.overlay(self.markers[name])
+        return self.markers[name]
+
+    def set_data(self, analysis, plot_type):
+        ax = self.axes[0]
+        # The spectrum (in dB) and band peaks are computed once per file by the cache
+        freq, _ = analysis.spectrum()
+        amplitude_spectrum_db = analysis.spectrum_db()
+        layout = bands.band_layout(freq)
+        band_peaks = analysis.band_peaks()
+
+        if plot_type == 'all':
+            band = slice(int(layout.starts.min()), int(layout.stops.max()))
+            shown = list(band_peaks)
+            ax.set_title("Combined Frequency")
+        else:
+            band = layout.slices[plot_type]
+            shown = [plot_type]
+            ax.set_title(f"{plot_type.capitalize()} Frequency")
+
+        # Convert frequency to time: Time (t) = 1 / Frequency (f)
+        self.line.set_data(1 / freq[band], amplitude_spectrum_db[band])
+        for name in self.markers:
+            self.markers[name].set_visible(name in shown)
+        for name in shown:
+            peak_freq, peak_value = band_peaks[name]
+            self.marker(name).set_data([1 / peak_freq], [peak_value])
+
+        ax.relim(visible_only=True)
+        ax.autoscale_view()
+        return analysis, plot_type
+
+
+# Frequency heatmap (STFT in dB) with its colorbar
+class HeatmapView(PlotView):
+    def __init__(self, figure, blit=False):
+        super().__init__(figure, blit)
+        ax = figure.add_subplot(111)
+        self.image = ax.imshow(np.zeros((2, 2)), aspect='auto', cmap='autumn_r', origin='lower', vmin=0, vmax=100)
+        cbar = figure.colorbar(self.image, ax=ax)
+        self.axes = [ax, cbar.ax]
+        ax.set_title("Frequency Heatmap")
+        ax.set_xlabel("Time (s)")
+        ax.set_ylabel("Frequency (Hz)")
+        cbar.set_label("Intensity (dB)")
+
+    def set_data(self, freq, time, heatmap_db):
+        ax = self.axes[0]
+        self.image.set_data(heatmap_db)
+        extent = [0, time[-1] if len(time) else 1, freq[0], freq[-1]]
+        self.image.set_extent(extent)
+        ax.set_xlim(extent[:2])
+        ax.set_ylim(extent[2:])
+        return (heatmap_db,)
+
+
+# One color per compared file: distinct colors for a few files, a gradient for many
+def file_colors(count):
+    if count <= 10:
+        return colormaps['tab10'](np.arange(count))
+    return colormaps['viridis'](np.linspace(0, 1, count))
+
+
+# Shortens a file name for a label
+def short_name(name, length=24):
+    return name if len(name) <= length else name[:length - 3] + "..."
+
+
+# The summaries of a comparison that have data (files that failed to load are left out)
+def loaded(summaries):
+    return [summary for summary in summaries if not summary.error]
+
+
+# The spectra of all compared files overlaid on a log frequency axis
+class CompareSpectrumView(PlotView):
+    def __init__(self, figure, blit=False):
+        super().__init__(figure, blit)
+        ax = figure.add_subplot(111)
+        self.axes = [ax]
+        self.lines = LineCollection([], linewidths=1, alpha=0.8)
+        ax.add_collection(self.lines)
+        ax.set_xscale('log')
+        ax.set_title("Spectrum Comparison")
+        ax.set_xlabel("Frequency (Hz)")
+        ax.set_ylabel("Power (dB)")
+        ax.grid(True, which='both', alpha=0.3)
+        self.legend = None
+
+    def set_data(self, summaries):
+        import comparison
+
+        ax = self.axes[0]
+        shown = loaded(summaries)
+        colors = file_colors(len(shown))
+        self.lines.set_segments([np.column_stack([comparison.SPECTRUM_FREQS, summary.spectrum_db])
+                                 for summary in shown])
+        self.lines.set_color(colors)
+
+        if self.legend is not None:
+            self.legend.remove()
+            self.legend = None
+        if 0 < len(shown) <= MAX_LABELED_FILES:
+            handles = [Line2D([], [], color=color) for color in colors]
+            self.legend = ax.legend(handles, [short_name(summary.name) for summary in shown],
+                                    fontsize='x-small', loc='lower left')
+
+        values = np.concatenate([summary.spectrum_db for summary in shown]) if shown else np.zeros(0)
+        values = values[np.isfinite(values)]
+        top = max((summary.framerate / 2 for summary in shown), default=comparison.SPECTRUM_RANGE[1])
+        ax.set_xlim(comparison.SPECTRUM_RANGE[0], top)
+        if len(values):
+            ax.set_ylim(values.min() - 3, values.max() + 3)
+        return tuple(summaries)
+
+
+# The waveform envelopes of all compared files stacked above each other, scaled to the
+# loudest file so their levels can be compared
+class CompareWaveformView(PlotView):
+    def __init__(self, figure, blit=False):
+        super().__init__(figure, blit)
+        ax = figure.add_subplot(111)
+        self.axes = [ax]
+        self.envelopes = PolyCollection([], linewidths=0.5)
+        ax.add_collection(self.envelopes)
+        ax.set_title("Waveform Comparison")
+        ax.set_xlabel("Time (s)")
+
+    def set_data(self, summaries):
+        ax = self.axes[0]
+        shown = loaded(summaries)
+        scale = 0.45 / max(max((summary.peak_amplitude for summary in shown), default=1.0), 1e-12)
+        polygons = []
+        for row, summary in enumerate(shown):
+            offset = len(shown) - 1 - row  # The first file is drawn at the top
+            x = np.concatenate([summary.envelope_times, summary.envelope_times[::-1]])
+            y = offset + scale * np.concatenate([summary.envelope_max, summary.envelope_min[::-1]])
+            polygons.append(np.column_stack([x, y]))
+        colors = file_colors(len(shown))
+        self.envelopes.set_verts(polygons)
+        self.envelopes.set_facecolor(colors)
+        self.envelopes.set_edgecolor(colors)
+
+        ax.set_xlim(0, max((summary.duration for summary in shown), default=1.0))
+        ax.set_ylim(-0.5, max(len(shown), 1) - 0.5)
+        if len(shown) <= MAX_LABELED_FILES * 2:
+            ax.set_yticks(np.arange(len(shown))[::-1], [short_name(summary.name, 16) for summary in shown],
+                          fontsize='x-small')
+        else:
+            ax.set_yticks([])
+        return tuple(summaries)
+
+
+# The heatmaps of all compared files as small multiples, tiled into one image so that
+# dozens of files are still a single artist
+class CompareHeatmapView(PlotView):
+    def __init__(self, figure, blit=False):
+        super().__init__(figure, blit)
+        ax = figure.add_subplot(111)
+        self.axes = [ax]
+        cmap = colormaps['autumn_r'].with_extremes(bad='white')
+        self.image = ax.imshow(np.zeros((2, 2)), aspect='auto', cmap=cmap, origin='lower', vmin=0, vmax=100,
+                               interpolation='nearest')
+        ax.set_title("Frequency Heatmap Comparison")
+        ax.set_xticks([])
+        ax.set_yticks([])
+        self.labels = []
+
+    def set_data(self, summaries):
+        import comparison
+
+        ax = self.axes[0]
+        shown = loaded(summaries)
+        tile_rows, tile_cols = comparison.HEATMAP_SHAPE
+        n_cols = max(1, int(np.ceil(np.sqrt(len(shown)))))
+        n_rows = max(1, -(-len(shown) // n_cols))
+        height, width = tile_rows + TILE_GAP, tile_cols + TILE_GAP
+        mosaic = np.full((n_rows * height, n_cols * width), np.nan, dtype=np.float32)
+
+        for label in self.labels:
+            label.remove()
+        self.labels = []
+        for i, summary in enumerate(shown):
+            # origin='lower' puts row 0 at the bottom, so the first file goes in the top row
+            top = (n_rows - 1 - i // n_cols) * height
+            left = (i % n_cols) * width
+            mosaic[top:top + tile_rows, left:left + tile_cols] = summary.heatmap_db
+            if len(shown) <= MAX_LABELED_FILES * 3:
+                self.labels.append(ax.text(left + 2, top + tile_rows - 2, short_name(summary.name, 20),
+                                           fontsize='xx-small', va='top', ha='left'))
+
+        self.image.set_data(mosaic)
+        self.image.set_extent([0, mosaic.shape[1], 0, mosaic.shape[0]])
+        ax.set_xlim(0, mosaic.shape[1])
+        ax.set_ylim(0, mosaic.shape[0])
+        return tuple(summaries)
+
+
+# The comparison views by name
+COMPARE_VIEWS = {
+    'spectrum': CompareSpectrumView,
+    'waveform': CompareWaveformView,
+    'heatmap': CompareHeatmapView,
+}
+
+
+# A set_data key that does not keep the drawn objects (analyses, arrays) alive
+def weak_key(key):
+    return tuple(item if isinstance(item, str) else weakref.ref(item) for item in key)
+
+
+# True if a weak key refers to the same objects as a set_data key (names are compared by value)
+def same_data(weak, key):
+    return len(weak) == len(key) and all(
+        a == b if isinstance(a, str) else a() is b for a, b in zip(weak, key))
+
+
+# Builds a standalone figure showing one view, e.g. for headless rendering
+def view_figure(view_class, *args, **view_options):
+    fig = Figure(figsize=FIGURE_SIZE)
+    view = view_class(fig, **view_options)
+    with profiling.stage('render.set_data', view=view_class.__name__):
+        view.set_data(*args)
+    with profiling.stage('render.tight_layout'):
+        fig.tight_layout(pad=2)
+    return fig
+
+
+# One Tk canvas that shows one view at a time
+class PlotSurface:
+    def __init__(self, master, figsize=FIGURE_SIZE):
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+        self.figure = Figure(figsize=figsize)
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.canvas.get_tk_widget().pack()
+        self.views = {}
+        self.current = None
+        # Per view: newest first list of (key of the drawn data, state, saved background)
+        self._backgrounds = {}
+        self._key = None
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    # Shows view `name` with the given data, the view is created with view_class(figure,
+    # blit=True, **view_options) the first time
+    def show(self, name, view_class, *args, **view_options):
+        view = self.views.get(name)
+        first = view is None
+        if first:
+            view = view_class(self.figure, blit=True, **view_options)
+            self.views[name] = view
+
+        for other_name, other in self.views.items():
+            if other_name != name:
+                other.set_visible(False)
+        view.set_visible(True)
+        if view.positions is not None:
+            for ax, position in zip(view.axes, view.positions):
+                ax.set_position(position)
+
+        self.current = name
+        with profiling.stage('render.set_data', view=name):
+            self._key = view.set_data(*args)
+        if first:
+            # The layout is computed once per view and restored whenever the view is shown
+            with profiling.stage('render.tight_layout'):
+                self.figure.tight_layout(pad=2)
+            view.positions = [ax.get_position(original=True) for ax in view.axes]
+
+        state = self._state()
+        for key, cached_state, background in self._backgrounds.get(name, []):
+            if same_data(key, self._key) and cached_state == state:
+                # Same data, view limits and size: reuse the rendered background and blit the overlays
+                with profiling.stage('render.blit', view=name):
+                    self.canvas.restore_region(background)
+                    self._blit_overlays()
+                return
+        with profiling.stage('render.draw', view=name):
+            self.canvas.draw()
+
+    # Canvas size and axis limits of the current view, a background is only valid for the same state
+    def _state(self):
+        limits = tuple(tuple(ax.viewLim.bounds) for ax in self.views[self.current].axes)
+        return self.canvas.get_width_height(), limits
+
+    # After every full draw (new data, zoom, resize) the background of the current view is
+    # saved and the overlays are drawn on top of it
+    def _on_draw(self, event):
+        if self.current is None:
+            return
+        backgrounds = self._backgrounds.setdefault(self.current, [])
+        backgrounds.insert(0, (weak_key(self._key), self._state(), self.canvas.copy_from_bbox(self.figure.bbox)))
+        del backgrounds[BACKGROUNDS_PER_VIEW:]
+        self._blit_overlays()
+
+    def _blit_overlays(self):
+        self.views[self.current].draw_overlays()
+        self.canvas.blit(self.figure.bbox)
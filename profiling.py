@@ -0,0 +1,176 @@
+### This file holds the timing instrumentation. Decode, analysis and render
+### steps are wrapped in named stages; when tracing is switched on every stage
+### is recorded (duration, thread and optionally traced memory) and the session
+### is written as a Chrome trace (open it in chrome://tracing or ui.perfetto.dev).
+### When tracing is off a stage is a shared no-op, so the cost is one call.
+###
+### SPIDAM_TRACE=1 writes spidam-trace-<time>-<pid>.json in the working directory,
+### SPIDAM_TRACE=<file> writes to that file, SPIDAM_TRACE_MEMORY=1 adds tracemalloc counters.
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+# Category of every stage name prefix, shown as the event category in the trace
+CATEGORIES = {'decode': 'decode', 'render': 'render'}
+DEFAULT_CATEGORY = 'analysis'
+
+# Stages kept for the status bar readout, the trace itself keeps every event
+RECENT_STAGES = 64
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+# Records the stages of one session as Chrome trace events
+class Tracer:
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self._recent = []
+        self._threads = {}
+        self._lock = threading.Lock()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    # Microseconds of the monotonic clock, which is shared by all processes so their traces line up
+    @staticmethod
+    def _now():
+        return time.perf_counter() * 1e6
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        thread = threading.current_thread()
+        base = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        start = self._now()
+        try:
+            yield
+        finally:
+            duration = self._now() - start
+            event = {'name': name, 'cat': CATEGORIES.get(name.split('.')[0], DEFAULT_CATEGORY), 'ph': 'X',
+                     'ts': start, 'dur': duration, 'pid': os.getpid(), 'tid': thread.ident}
+            if args:
+                event['args'] = args
+            counter = None
+            if self.memory:
+                current = tracemalloc.get_traced_memory()[0]
+                event.setdefault('args', {})['allocated_kb'] = round((current - base) / 1024, 1)
+                counter = {'name': 'traced memory', 'ph': 'C', 'ts': start + duration, 'pid': os.getpid(),
+                           'args': {'MB': round(current / 2**20, 2)}}
+            with self._lock:
+                self._threads.setdefault(thread.ident, thread.name)
+                self.events.append(event)
+                if counter is not None:
+                    self.events.append(counter)
+                self._recent.append((name, duration / 1000))
+                del self._recent[:-RECENT_STAGES]
+
+    # (name, milliseconds) of the stages finished since the last call, oldest first
+    def take_recent(self):
+        with self._lock:
+            recent, self._recent = self._recent, []
+        return recent
+
+    # The events with the thread name metadata the trace viewers use
+    def trace_events(self):
+        with self._lock:
+            names = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                     for ident, name in self._threads.items()]
+            return names + list(self.events)
+
+    # Returns the trace events recorded so far and forgets them
+    def drain(self):
+        events = self.trace_events()
+        with self._lock:
+            self.events = []
+        return events
+
+    def write(self, file_path, extra_events=()):
+        with open(file_path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events() + list(extra_events), 'displayTimeUnit': 'ms'}, f)
+
+
+# The tracer of this process, None while tracing is off
+_tracer = None
+_trace_path = None
+
+
+def enabled():
+    return _tracer is not None
+
+
+def tracer():
+    return _tracer
+
+
+# Switches tracing on, the trace is written to file_path when the process exits (if given)
+def enable(file_path=None, memory=False):
+    global _tracer, _trace_path
+    if _tracer is None:
+        _tracer = Tracer(memory)
+        atexit.register(_write_at_exit)
+    if file_path is not None:
+        _trace_path = file_path
+    return _tracer
+
+
+def disable():
+    global _tracer, _trace_path
+    _tracer, _trace_path = None, None
+
+
+def default_trace_path():
+    return f"spidam-trace-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+
+
+# Switches tracing on according to SPIDAM_TRACE and SPIDAM_TRACE_MEMORY
+def enable_from_environment():
+    value = os.environ.get("SPIDAM_TRACE", "0")
+    if value in ("", "0"):
+        return None
+    return enable(default_trace_path() if value == "1" else value,
+                  os.environ.get("SPIDAM_TRACE_MEMORY", "0") == "1")
+
+
+def _write_at_exit():
+    if _tracer is not None and _trace_path:
+        try:
+            _tracer.write(_trace_path)
+        except OSError as error:
+            print(f"Warning: could not write the trace to {_trace_path} ({error})")
+
+
+# Context manager timing one stage, e.g. `with profiling.stage('fft'):`
+# Names starting with 'decode' or 'render' are put in those categories, all others are analysis
+def stage(name, **args):
+    if _tracer is None:
+        return _NO_STAGE
+    return _tracer.stage(name, **args)
+
+
+# Total milliseconds and count of every stage name in a list of trace events, slowest first
+def summarize(events):
+    totals = {}
+    for event in events:
+        if event['ph'] == 'X':
+            total, count = totals.get(event['name'], (0.0, 0))
+            totals[event['name']] = (total + event['dur'] / 1000, count + 1)
+    return dict(sorted(totals.items(), key=lambda item: -item[1][0]))
+
+
+# Short readout of the stages finished since the last call, e.g. "decode 12 ms | fft 30 ms"
+# Repeated stages are added up, returns "" while tracing is off or nothing ran
+def recent_summary():
+    if _tracer is None:
+        return ""
+    totals = {}
+    for name, milliseconds in _tracer.take_recent():
+        totals[name] = totals.get(name, 0.0) + milliseconds
+    return " | ".join(f"{name} {milliseconds:.0f} ms" if milliseconds >= 1 else f"{name} {milliseconds:.1f} ms"
+                      for name, milliseconds in totals.items())
+
+
+enable_from_environment()
@@ -0,0 +1,156 @@
+### This file holds the reverberation time (RT60) analysis. The loudest event
+### of a recording (a clap, balloon pop or starter pistol) is located, each band
+### is band-pass filtered at a reduced sample rate, and the decay times are
+### fitted to the Schroeder energy decay curve (ISO 3382 style T20/T30).
+
+import numpy as np
+import bands
+import wavreader
+
+# Seconds of the recording after the impulse that are analyzed, enough for large halls
+MAX_DECAY_SECONDS = 10.0
+
+# Seconds before the impulse peak included so the filters see the whole onset
+PRE_IMPULSE_SECONDS = 0.005
+
+# Butterworth order of the band filters (doubled by the forward-backward filtering)
+BAND_FILTER_ORDER = 4
+
+# A band is filtered at the lowest power-of-two decimated rate whose Nyquist
+# frequency is still this many times above the band's upper edge
+DECIMATION_HEADROOM = 1.5
+
+# Length (s) of the blocks used to smooth the energy envelope when looking for the noise floor
+ENVELOPE_BLOCK_SECONDS = 0.01
+
+# The decay curve is cut where the envelope falls within this many dB of the noise floor
+NOISE_MARGIN_DB = 5.0
+
+# Decay ranges (dB below the start of the curve) fitted for each measure,
+# RT20 and RT30 are extrapolated to a 60 dB decay, EDT from a 10 dB decay
+DECAY_RANGES = {
+    'edt': (0.0, -10.0),
+    'rt20': (-5.0, -25.0),
+    'rt30': (-5.0, -35.0),
+}
+
+# Fields of the result of every band, rt60 is rt30 when the dynamic range allows it, else rt20
+DECAY_FIELDS = ('edt', 'rt20', 'rt30', 'rt60')
+
+
+# Returns the index of the largest absolute sample, scanning long (memory-mapped) input in chunks
+def find_impulse(samples, chunk_frames=wavreader.DEFAULT_CHUNK_FRAMES):
+    best_index, best_value = 0, -1.0
+    for start in range(0, len(samples), chunk_frames):
+        chunk = np.abs(np.asarray(samples[start:start + chunk_frames], dtype=np.float32))
+        index = int(np.argmax(chunk))
+        if chunk[index] > best_value:
+            best_index, best_value = start + index, float(chunk[index])
+    return best_index
+
+
+# Schroeder backward integration of the squared signal, normalized to 0 dB at the start
+def energy_decay_curve(energy):
+    edc = np.cumsum(energy[::-1], dtype=np.float64)[::-1]
+    return 10 * np.log10(edc / edc[0] + 1e-300)
+
+
+# Cuts the squared band signal where its smoothed envelope meets the noise floor, which is
+# estimated from the last 10 % of the segment, and returns the part starting at the envelope peak
+def truncate_decay(energy, framerate):
+    block = max(1, int(framerate * ENVELOPE_BLOCK_SECONDS))
+    n_blocks = len(energy) // block
+    if n_blocks < 10:
+        return energy
+    envelope = energy[:n_blocks * block].reshape(n_blocks, block).mean(axis=1)
+    noise = envelope[-max(1, n_blocks // 10):].mean()
+    peak = int(np.argmax(envelope))
+    below = np.flatnonzero(envelope[peak:] < noise * 10 ** (NOISE_MARGIN_DB / 10))
+    stop = (peak + below[0]) * block if len(below) else len(energy)
+    return energy[peak * block:max(stop, (peak + 1) * block)]
+
+
+# Decay time (s) extrapolated to 60 dB from a linear fit of the decay curve between
+# start_db and stop_db, NaN if the curve does not decay far enough
+def fit_decay(edc_db, framerate, start_db, stop_db):
+    # The curve never rises, so the range is found by binary search on its negation
+    first = np.searchsorted(-edc_db, -start_db, side='left')
+    last = np.searchsorted(-edc_db, -stop_db, side='right')
+    if last >= len(edc_db) or last - first < 3:
+        return float('nan')
+    t = np.arange(first, last) / framerate
+    slope = np.polyfit(t, edc_db[first:last], 1)[0]
+    return float(-60.0 / slope) if slope < 0 else float('nan')
+
+
+# Decay times of one (already filtered) band signal as a dict of DECAY_FIELDS
+def band_decay_times(band_signal, framerate):
+    edc_db = energy_decay_curve(truncate_decay(np.square(band_signal, dtype=np.float64), framerate))
+    result = {name: fit_decay(edc_db, framerate, *limits) for name, limits in DECAY_RANGES.items()}
+    result['rt60'] = result['rt30'] if np.isfinite(result['rt30']) else result['rt20']
+    return result
+
+
+# Power-of-two decimation factor used for a band with the given upper edge (None means Nyquist)
+def decimation_factor(high, framerate, n_samples):
+    if high is None:
+        return 1
+    q = 1
+    while (framerate / (2 * q)) / 2 >= high * DECIMATION_HEADROOM and n_samples // (2 * q) >= 1024:
+        q *= 2
+    return q
+
+
+# Second-order sections of the filter for band (low, high) at the given rate, None if the band
+# lies entirely above its Nyquist frequency
+def band_filter(low, high, framerate):
+    from scipy import signal  # Imported on first use, scipy takes a while to import
+    nyquist = framerate / 2
+    if low >= nyquist * 0.95:
+        return None
+    if high is None or high >= nyquist * 0.95:
+        return signal.butter(BAND_FILTER_ORDER, low, btype='highpass', fs=framerate, output='sos')
+    if low <= 0:
+        return signal.butter(BAND_FILTER_ORDER, high, btype='lowpass', fs=framerate, output='sos')
+    return signal.butter(BAND_FILTER_ORDER, [low, high], btype='bandpass', fs=framerate, output='sos')
+
+
+# Edge padding sosfiltfilt uses by default, computed the way scipy does it: a signal must be
+# longer than this to be filtered
+def filtfilt_padlen(sos):
+    trailing_zeros = min(np.count_nonzero(sos[:, 2] == 0), np.count_nonzero(sos[:, 5] == 0))
+    return 3 * (2 * len(sos) + 1 - trailing_zeros)
+
+
+# Reverberation times of every band of a band set (see bands.BAND_SETS) as a dict
+# {band name: {'edt', 'rt20', 'rt30', 'rt60'}} in seconds, NaN where a band has too little decay
+# Only the MAX_DECAY_SECONDS after the loudest event are analyzed, so the cost does not
+# depend on the recording length, and every band is filtered at a decimated rate
+# progress, if given, is called with the fraction of bands done
+def decay_times(samples, framerate, band_set='octave', max_seconds=MAX_DECAY_SECONDS, progress=None):
+    from scipy import signal
+
+    band_edges = bands.get_band_set(band_set) if isinstance(band_set, str) else band_set
+
+    impulse = find_impulse(samples)
+    start = max(0, impulse - int(PRE_IMPULSE_SECONDS * framerate))
+    segment = np.asarray(samples[start:impulse + int(max_seconds * framerate)], dtype=np.float64)
+    segment -= segment.mean()
+
+    # Decimated copies of the segment, each made from the previous one by a factor of two
+    decimated = {1: segment}
+    results = {}
+    for done, (name, (low, high)) in enumerate(band_edges.items(), 1):
+        q = decimation_factor(high, framerate, len(segment))
+        while q not in decimated:
+            previous = max(decimated)
+            decimated[previous * 2] = signal.decimate(decimated[previous], 2, zero_phase=True)
+        rate = framerate / q
+        sos = band_filter(low, high, rate)
+        if sos is None or len(decimated[q]) <= filtfilt_padlen(sos):
+            results[name] = {field: float('nan') for field in DECAY_FIELDS}
+        else:
+            results[name] = band_decay_times(signal.sosfiltfilt(sos, decimated[q]), rate)
+        if progress is not None:
+            progress(done / len(band_edges))
+    return results
@@ -0,0 +1,210 @@
+### This file holds the shared spectral analysis code (spectrum, STFT) used by
+### the plotting modules, the band sets built on it are in bands.py. It has no
+### GUI dependencies so it can be reused anywhere.
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Default STFT settings (these match the original heatmap loop)
+DEFAULT_WINDOW_SIZE = 1024
+DEFAULT_HOP_SIZE = 512
+
+# Number of frames transformed per batched rfft call, keeps the temporary
+# windowed frame matrix to a few tens of MB even for very long recordings
+FRAMES_PER_BATCH = 4096
+
+# Default precision of the spectral pipeline, np.float32 halves memory and is faster
+# while staying far more precise than the 16-bit input
+DEFAULT_DTYPE = np.float64
+
+# Window functions that can be selected by name
+WINDOW_FUNCTIONS = {
+    'hann': np.hanning,
+    'hamming': np.hamming,
+    'blackman': np.blackman,
+    'bartlett': np.bartlett,
+    'rectangular': np.ones,
+}
+
+# Cache of window arrays so they are only built once per (name, size, dtype)
+_window_cache = {}
+
+
+# Returns the (cached) window array for the given name and size
+def get_window(name, size, dtype=np.float64):
+    key = (name, size, np.dtype(dtype).str)
+    window = _window_cache.get(key)
+    if window is None:
+        if name not in WINDOW_FUNCTIONS:
+            raise ValueError(f"Unknown window '{name}', choose from {sorted(WINDOW_FUNCTIONS)}")
+        window = WINDOW_FUNCTIONS[name](size).astype(dtype)
+        window.flags.writeable = False
+        _window_cache[key] = window
+    return window
+
+
+# Smallest length >= n whose only prime factors are 2, 3 and 5, the FFT of such a
+# length is fast while a prime length (e.g. an odd number of samples) can be many times slower
+def next_fast_len(n):
+    if n <= 6:
+        return max(n, 1)
+    best = 1 << (n - 1).bit_length()
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            # Smallest power of two that brings power35 up to n
+            candidate = power35
+            if candidate < n:
+                candidate <<= (-(-n // candidate) - 1).bit_length()
+            best = min(best, candidate)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+# Positive frequency magnitude spectrum of a real signal as (freq, magnitude)
+# The magnitude is computed in the given dtype and divided by the number of samples, so a
+# sine of amplitude A peaks at about A / 2. The level of broadband noise still falls with
+# the length of the signal (the bins get narrower), file summaries use WelchSpectrum instead
+# With pad the signal is zero padded to a fast FFT length, which only makes the
+# frequency grid slightly finer
+def rfft_spectrum(samples, framerate, dtype=DEFAULT_DTYPE, pad=True):
+    samples = np.asarray(samples)
+    n_fft = next_fast_len(len(samples)) if pad else len(samples)
+    magnitude = np.abs(np.fft.rfft(samples.astype(dtype, copy=False), n=n_fft))
+    magnitude /= max(len(samples), 1)
+    # The frequency grid stays float64 so reported peak frequencies are exact
+    freq = np.fft.rfftfreq(n_fft, d=1 / framerate)
+    return freq, magnitude
+
+
+# Index range of the (ascending) freq array that lies within [low, high] Hz,
+# so a band is a cheap slice instead of a boolean mask over the whole spectrum
+def band_slice(freq, low, high=None):
+    start = np.searchsorted(freq, low, side='left')
+    stop = len(freq) if high is None else np.searchsorted(freq, high, side='right')
+    return slice(int(start), int(max(start, stop)))
+
+
+# Number of full frames that fit in the signal
+def frame_count(n_samples, window_size=DEFAULT_WINDOW_SIZE, hop_size=DEFAULT_HOP_SIZE):
+    if n_samples < window_size:
+        return 0
+    return 1 + (n_samples - window_size) // hop_size
+
+
+# Returns a read-only (num_frames, window_size) view of the signal, no data is copied
+def frame_view(samples, window_size=DEFAULT_WINDOW_SIZE, hop_size=DEFAULT_HOP_SIZE):
+    samples = np.asarray(samples)
+    num_frames = frame_count(len(samples), window_size, hop_size)
+    if num_frames == 0:
+        return np.empty((0, window_size), dtype=samples.dtype)
+    return sliding_window_view(samples[:(num_frames - 1) * hop_size + window_size], window_size)[::hop_size]
+
+
+# Computes the magnitude STFT of a real signal
+# Returns (freq, time, magnitude) where magnitude has shape (window_size // 2 + 1, num_columns)
+# When max_columns is set, runs of consecutive frames are merged (keeping the loudest
+# value per bin) so the result never has more columns than that, which bounds memory
+# for arbitrarily long (memory-mapped) signals
+# progress, if given, is called with the fraction of frames done after each batch
+def stft(samples, framerate, window_size=DEFAULT_WINDOW_SIZE, hop_size=DEFAULT_HOP_SIZE,
+         window='hann', dtype=np.float64, max_columns=None, progress=None):
+    dtype = np.dtype(dtype)
+    num_frames = frame_count(len(samples), window_size, hop_size)
+    win = get_window(window, window_size, dtype)
+
+    # Number of frames merged into each output column
+    group = 1
+    if max_columns is not None and num_frames > max_columns:
+        group = -(-num_frames // max_columns)
+    num_columns = -(-num_frames // group)
+    batch_size = max(group, FRAMES_PER_BATCH // group * group)
+
+    freq = np.fft.rfftfreq(window_size, d=1 / framerate)
+    time = np.arange(num_columns) * group * hop_size / framerate
+    magnitude = np.empty((len(freq), num_columns), dtype=dtype)
+
+    # Window and transform the frames in batches with a single rfft call each, only the samples
+    # of a batch are read at a time (samples can be a memory-mapped or wavreader.MonoView signal)
+    for start in range(0, num_frames, batch_size):
+        stop = min(start + batch_size, num_frames)
+        frames = frame_view(samples[start * hop_size:(stop - 1) * hop_size + window_size], window_size, hop_size)
+        windowed = frames.astype(dtype) * win
+        spectrum = np.abs(np.fft.rfft(windowed, axis=1))
+        if group > 1:
+            spectrum = np.maximum.reduceat(spectrum, np.arange(0, stop - start, group), axis=0)
+        magnitude[:, start // group:start // group + len(spectrum)] = spectrum.T
+        if progress is not None:
+            progress(stop / num_frames)
+
+    return freq, time, magnitude
+
+
+# Converts a magnitude array to decibels
+def magnitude_to_db(magnitude):
+    eps = np.finfo(magnitude.dtype if magnitude.dtype.kind == 'f' else float).eps
+    return 20 * np.log10(magnitude + eps)
+
+
+# Frequency of the largest magnitude, ignoring the DC component (0 Hz)
+def peak_frequency(freq, magnitude):
+    return float(freq[np.argmax(magnitude[1:]) + 1])
+
+
+# Default frequency resolution (Hz) of the averaged spectrum used for long recordings
+DEFAULT_RESOLUTION = 1.0
+
+# Number of segments transformed per batched rfft call in WelchSpectrum
+SEGMENTS_PER_BATCH = 64
+
+
+# Averaged (Welch-style) power spectrum that is built up from blocks of samples,
+# so the spectrum of an arbitrarily long signal is computed with constant memory
+class WelchSpectrum:
+    def __init__(self, framerate, resolution=DEFAULT_RESOLUTION, window='hann', dtype=np.float64):
+        self.framerate = framerate
+        self.dtype = np.dtype(dtype)
+
+        # Segment length is the smallest power of two giving at least the requested resolution
+        self.segment_size = 1 << max(1, int(np.ceil(np.log2(framerate / resolution))))
+        self.hop_size = self.segment_size // 2
+        self.resolution = framerate / self.segment_size
+        self.freq = np.fft.rfftfreq(self.segment_size, d=1 / framerate)
+
+        self._window = get_window(window, self.segment_size, self.dtype)
+        self._power_sum = np.zeros(len(self.freq), dtype=np.float64)
+        self._segments = 0
+        self._tail = np.empty(0, dtype=self.dtype)
+        self.samples_seen = 0
+
+    # Adds a block of samples, any partial segment is carried over to the next block
+    def update(self, block):
+        block = np.asarray(block, dtype=self.dtype)
+        self.samples_seen += len(block)
+        buffer = np.concatenate([self._tail, block]) if len(self._tail) else block
+
+        frames = frame_view(buffer, self.segment_size, self.hop_size)
+        for start in range(0, len(frames), SEGMENTS_PER_BATCH):
+            batch = frames[start:start + SEGMENTS_PER_BATCH] * self._window
+            spectrum = np.fft.rfft(batch, axis=1)
+            self._power_sum += np.sum(spectrum.real ** 2 + spectrum.imag ** 2, axis=0)
+        self._segments += len(frames)
+
+        self._tail = buffer[len(frames) * self.hop_size:].copy()
+
+    # Average power per bin, a signal shorter than one segment is zero padded
+    def power(self):
+        if self._segments == 0:
+            padded = np.zeros(self.segment_size, dtype=self.dtype)
+            padded[:len(self._tail)] = self._tail
+            spectrum = np.fft.rfft(padded * self._window)
+            return np.abs(spectrum) ** 2
+        return self._power_sum / self._segments
+
+    # Average magnitude per bin as (freq, magnitude), divided by the window sum so a sine of
+    # amplitude A peaks at about A / 2. The segment size is fixed by the resolution, so the
+    # level of noise does not depend on the length of the signal either
+    def spectrum(self):
+        return self.freq, np.sqrt(self.power()) / self._window.sum(dtype=np.float64)
@@ -0,0 +1,146 @@
+### This file holds the background task scheduler used by the GUI. Decoding and
+### analysis run on a worker pool, and their results (and progress updates) are
+### handed back to the Tk mainloop through root.after, since Tk widgets may only
+### be touched from the main thread.
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of worker threads (NumPy releases the GIL during FFTs)
+DEFAULT_WORKERS = 2
+
+# Channels whose tasks can run for minutes (a whole-file export, or waiting on the process
+# pool of a comparison) get workers of their own, so they never hold up the interactive
+# channels ('file', 'plot', 'reverb'), and how many of those workers there are
+BACKGROUND_CHANNELS = ('export', 'compare')
+DEFAULT_BACKGROUND_WORKERS = 2
+
+# How often (ms) the mainloop checks for finished work
+POLL_INTERVAL_MS = 50
+
+
+# Raised inside a task once it has been cancelled, to stop its work early
+class TaskCancelled(Exception):
+    pass
+
+
+# Handle given to the function running in the background, used to report
+# progress and to find out whether the task has been cancelled
+class Task:
+    def __init__(self, scheduler, channel, generation, on_done=None, on_error=None):
+        self.channel = channel
+        self.generation = generation
+        self.on_done = on_done
+        self.on_error = on_error
+        self._scheduler = scheduler
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    # Stops the task if it was cancelled
+    def check(self):
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    # Reports progress (fraction between 0 and 1, or None if unknown) to the GUI,
+    # also a convenient point to stop a cancelled task
+    def progress(self, fraction=None, message=None):
+        self.check()
+        self._scheduler._queue.put(('progress', self, (fraction, message)))
+
+
+# Runs functions on a worker pool and delivers their results on the Tk mainloop
+# Every task belongs to a channel (e.g. 'file' or 'plot'), and only the result of
+# the most recently submitted task of a channel is delivered, older ones are stale
+class TaskScheduler:
+    def __init__(self, root, workers=DEFAULT_WORKERS, on_progress=None, background_workers=DEFAULT_BACKGROUND_WORKERS):
+        self.root = root
+        self.on_progress = on_progress
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self._background_executor = ThreadPoolExecutor(max_workers=background_workers,
+                                                       thread_name_prefix="background")
+        self._queue = queue.Queue()
+        self._current = {}
+        self._lock = threading.Lock()
+        self.root.after(POLL_INTERVAL_MS, self._poll)
+
+    # Runs func(task, *args) in the background and calls on_done(result) or
+    # on_error(exception) on the main thread if the task is still current
+    # With cancel_previous the older task of the channel is also told to stop
+    def submit(self, channel, func, *args, on_done=None, on_error=None, cancel_previous=False):
+        with self._lock:
+            previous = self._current.get(channel)
+            generation = previous.generation + 1 if previous is not None else 0
+            task = Task(self, channel, generation, on_done, on_error)
+            self._current[channel] = task
+        if previous is not None and cancel_previous:
+            previous.cancel()
+        executor = self._background_executor if channel in BACKGROUND_CHANNELS else self._executor
+        executor.submit(self._run, task, func, args)
+        return task
+
+    # Cancels the current tasks of the given channels, or of every channel if none are given
+    def cancel(self, *channels):
+        with self._lock:
+            for name in channels or list(self._current):
+                task = self._current.pop(name, None)
+                if task is not None:
+                    task.cancel()
+        if self.on_progress is not None:
+            self.on_progress(None, None, None)
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._background_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, task, func, args):
+        if task.cancelled:
+            return
+        try:
+            result = func(task, *args)
+        except TaskCancelled:
+            return
+        except Exception as error:
+            self._queue.put(('error', task, error))
+        else:
+            self._queue.put(('done', task, result))
+
+    def _is_current(self, task):
+        with self._lock:
+            return self._current.get(task.channel) is task and not task.cancelled
+
+    # Delivers queued results and progress on the main thread
+    def _poll(self):
+        try:
+            while True:
+                kind, task, payload = self._queue.get_nowait()
+                if not self._is_current(task):
+                    continue  # Stale result of a task that has been replaced or cancelled
+
+                if kind == 'progress':
+                    if self.on_progress is not None:
+                        self.on_progress(task.channel, *payload)
+                    continue
+
+                with self._lock:
+                    del self._current[task.channel]
+                if self.on_progress is not None:
+                    self.on_progress(task.channel, None, None)
+                if kind == 'done' and task.on_done is not None:
+                    task.on_done(payload)
+                elif kind == 'error':
+                    if task.on_error is not None:
+                        task.on_error(payload)
+                    else:
+                        print(f"Error in background task '{task.channel}': {payload}")
+        except queue.Empty:
+            pass
+        finally:
+            self.root.after(POLL_INTERVAL_MS, self._poll)
@@ -1,188 +1,241 @@
-from pydub import AudioSegment
 import AnalyticsModel as am
-import guicontroller
-import numpy as np
+import analysiscache
 import os
-from scipy.io import wavfile
-import matplotlib.pyplot as plt
-from pydub.utils import make_chunks
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import sys
+import numpy as np
+import profiling
+
+# guicontroller is only imported inside the functions that need the GUI (and by main),
+# so the figure builders here can be used headless, e.g. by benchmark.py
+# plotsurface (matplotlib) is imported when the first plot is drawn, so the window appears
+# before matplotlib has been loaded
 
 
 # This is a general plot for all three time series plots
+# The analysis runs in the background (see AnalyticsModel.prepare_timeseries)
 def plot_timeseries_general(file_path, plot_type):
+    import guicontroller
+
     if not file_path or file_path is None:
         return
 
     if not os.path.exists(file_path):
         return
 
-    with guicontroller.wave.open(file_path, 'rb') as wav_file:
-        params = wav_file.getparams()
-        n_channels, sampwidth, framerate, n_frames, comptype, compname = params[:6]
-        frames = wav_file.readframes(n_frames)
-        waveform = np.frombuffer(frames, dtype=np.int16)
-
-        # Create the time axis for time-domain plot
-        time_axis = np.linspace(0, n_frames / framerate, num=n_frames)
-
-        if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high' or plot_type == 'all':
-            # This is the frequency-domain plot
-            # Perform FFT to get the frequency spectrum
-            fft_spectrum = np.fft.fft(waveform)
-            freq = np.fft.fftfreq(len(fft_spectrum), d=1 / framerate)
-            amplitude_spectrum = np.abs(fft_spectrum)
-            amplitude_spectrum_db = am.amplitude_to_db(amplitude_spectrum)
-
-            # Define frequency range for all plots
-            if plot_type == 'all':
-                freq_range = (5, np.max(freq))
-                title = "Combined Frequency"
-                color = 'blue'
-
-            # Mask the spectrum to the chosen frequency range
-            mask = (freq >= freq_range[0]) & (freq <= freq_range[1])
-            filtered_freq = freq[mask]
-            filtered_amplitude_db = amplitude_spectrum_db[mask]
-
-            # Convert frequency to time: Time (t) = 1 / Frequency (f)
-            # We will plot the frequency axis as time-related data
-            time_related_axis = 1 / filtered_freq  # Convert frequency to time axis
-
-            # Create the frequency-domain plot (FFT) with time on the x-axis
-            fig = Figure(figsize=(6, 4))
-            ax = fig.add_subplot(111)
-            ax.plot(time_related_axis, filtered_amplitude_db, color='blue')  # Frequency spectrum line
-            ax.set_title(title)
-            ax.set_xlabel("Time (s)")  # Time on x-axis (converted from frequency)
-            ax.set_ylabel("Power (dB)")  # Power in dB on y-axis
-            ax.grid(True)
-
-            # Find the peak values for each frequency range and plot them
-            peak_low_index = np.argmax(amplitude_spectrum_db[(freq >= 5) & (freq <= 300)])
-            peak_low_freq = filtered_freq[peak_low_index]
-            peak_low_value = filtered_amplitude_db[peak_low_index]
-
-            peak_mid_index = np.argmax(amplitude_spectrum_db[(freq >= 300) & (freq <= 2000)])
-            peak_mid_freq = filtered_freq[peak_mid_index]
-            peak_mid_value = filtered_amplitude_db[peak_mid_index]
-
-            peak_high_index = np.argmax(amplitude_spectrum_db[(freq >= 2000) & (freq <= np.max(freq))])
-            peak_high_freq = filtered_freq[peak_high_index]
-            peak_high_value = filtered_amplitude_db[peak_high_index]
-
-            # Plot a dot at the highest value within each frequency range
-            ax.scatter(1 / peak_low_freq, peak_low_value, color='green', s=100, label=f"Peak Low Frequency")
-            ax.scatter(1 / peak_mid_freq, peak_mid_value, color='yellow', s=100, label=f"Peak Mid Frequency")
-            ax.scatter(1 / peak_high_freq, peak_high_value, color='red', s=100, label=f"Peak High Frequency")
-
-
-            fig.tight_layout(pad=2)
-
-        else:
-            # This is the time-domain plot (original waveform)
-            fig = Figure(figsize=(6, 4))
-            ax = fig.add_subplot(111)
-            ax.plot(time_axis, waveform, color='black')  # Time-domain plot
-            ax.set_title("Waveform")
-            ax.set_xlabel("Time (s)")  # Time on x-axis in seconds
-            ax.set_ylabel("Amplitude")  # Amplitude on y-axis
-            ax.grid(True)
-            fig.tight_layout(pad=2)
-
-        # Clear the canvas and attach the plot
-        for child in guicontroller.plot_canvas.winfo_children():
-            child.destroy()
-
-        canvas = FigureCanvasTkAgg(fig, master=guicontroller.plot_canvas)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
+    guicontroller.scheduler.submit('plot', am.prepare_timeseries, file_path, plot_type,
+                                   on_done=draw_timeseries_general, on_error=guicontroller.show_error)
+
+
+# Runs on the main thread once the analysis has finished
+def draw_timeseries_general(result):
+    import plotsurface
+    analysis, plot_type = result
+    if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high' or plot_type == 'all':
+        # This is the frequency-domain plot
+        am.show_view('combined', plotsurface.SpectrumView, analysis, plot_type)
+    else:
+        # This is the time-domain plot (original waveform)
+        am.show_view('waveform_grid', plotsurface.WaveformView, analysis, color='black', grid=True)
+
+
+# Builds the combined spectrum (or waveform) figure, needs no GUI
+def timeseries_general_figure(analysis, plot_type):
+    import plotsurface
+    if plot_type == 'low' or plot_type == 'mid' or plot_type == 'high' or plot_type == 'all':
+        return plotsurface.view_figure(plotsurface.SpectrumView, analysis, plot_type)
+    return plotsurface.view_figure(plotsurface.WaveformView, analysis, color='black', grid=True)
 
 def combine_plots():
+    import guicontroller
     new_file_path = guicontroller.selected_file_path
     plot_timeseries_general(new_file_path, 'all')
 
 
 # Plots Heatmap showing the frequency intensity
 def plot_specgram(file_path):
+    import guicontroller
+
     if not file_path or file_path is None:
         return
 
     if not os.path.exists(file_path):
         return
 
-    with guicontroller.wave.open(file_path, 'rb') as wav_file:
-        params = wav_file.getparams()
-        n_channels, sampwidth, framerate, n_frames, comptype, compname = params[:6]
-        frames = wav_file.readframes(n_frames)
-        waveform = np.frombuffer(frames, dtype=np.int16)
-
-        # Processes audio to prepare it for heatmap
-        audio_file = AudioSegment.from_file(file_path)
-        audio_file = audio_file.set_channels(1)
-        sample_data = np.array(audio_file.get_array_of_samples())
-        frame_rate = audio_file.frame_rate
-        window_size = 1024
-        hop_size = 512
-        num_frames = (len(sample_data) - window_size) // hop_size
-        freq = np.fft.fftfreq(window_size, d=1 / frame_rate)
-        freq = np.fft.fftshift(freq[:window_size // 2])
-        time = np.arange(num_frames) * hop_size / frame_rate
-
-        # Computes the FFT & magnitude and stores it in the heatmap
-        heatmap = np.zeros((len(freq), len(time)))
-        for i in range (num_frames):
-            start_idx = i * hop_size
-            end_idx = start_idx + window_size
-            windowed_samples = sample_data[start_idx:end_idx] * np.hanning(window_size)
-            spectrum = np.fft.fft(windowed_samples)
-            spectrum = np.fft.fftshift(spectrum)[:window_size // 2]
-            heatmap[:, i] = np.abs(spectrum)
-
-        # Converts the amplitude heatmap to decibels
-        heatmap_db = 20 * np.log10(heatmap + np.finfo(float).eps)
-
-        # Creates figure & displays heatmap
-        fig = Figure(figsize=(6, 4))
-        ax = fig.add_subplot(111)
-        im = ax.imshow(
-            heatmap_db, aspect='auto', cmap='autumn_r',
-            extent=[0, time[-1], freq[0], freq[-1]],
-            vmin=0, vmax=100
-        )
-        cbar = fig.colorbar(im, ax=ax)
-
-        ax.set_title("Frequency Heatmap")
-        ax.set_xlabel("Time (s)")
-        ax.set_ylabel("Frequency (Hz)")
-        cbar.set_label("Intensity (dB)")
-        ax.set_ylim([freq[0], freq[-1]])
-        fig.tight_layout(pad=2)
-
-        # Clear the canvas
-        for child in guicontroller.plot_canvas.winfo_children():
-            child.destroy()
-
-        # Attach the plot to the canvas
-        canvas = FigureCanvasTkAgg(fig, master=guicontroller.plot_canvas)
-        canvas.draw()
-        canvas.get_tk_widget().pack()
+    guicontroller.scheduler.submit('plot', prepare_specgram, file_path,
+                                   on_done=draw_specgram, on_error=guicontroller.show_error)
+
+
+# Runs on a worker thread: computes the STFT heatmap (in dB), cached once per file
+def prepare_specgram(task, file_path):
+    window_size = 1024
+    hop_size = 512
+    task.progress(None, "Loading audio")
+    analysis = analysiscache.get_analysis(file_path, task.progress)
+    task.progress(0, "Computing heatmap")
+    return analysis.stft(window_size, hop_size, progress=task.progress)
+
+
+# Runs on the main thread once prepare_specgram has finished
+def draw_specgram(result):
+    import plotsurface
+    am.show_view('heatmap', plotsurface.HeatmapView, *result)
+
+
+# Builds the heatmap figure, needs no GUI
+def specgram_figure(freq, time, heatmap_db):
+    import plotsurface
+    return plotsurface.view_figure(plotsurface.HeatmapView, freq, time, heatmap_db)
+
+
+# The comparison session (see comparison.py), created with the first comparison
+comparison_session = None
+
+# The summaries of the files being compared and the comparison view shown
+compared_files = []
+COMPARISON_VIEWS = ['spectrum', 'waveform', 'heatmap']
+current_comparison_view = 0
+
+# Lets the user pick several files and compares them, the files are analyzed in parallel in the background
+def compare_files():
+    import guicontroller
+    from tkinter import filedialog
+
+    file_paths = filedialog.askopenfilenames(filetypes=[("Audio Files", "*.wav *.mp3")])
+    if not file_paths:
+        return
+    guicontroller.selected_file_paths = list(file_paths)
+    guicontroller.nameLabel.config(text=f"Comparing {len(file_paths)} files")
+    guicontroller.scheduler.submit('compare', load_comparison, list(file_paths),
+                                   on_done=draw_comparison, on_error=guicontroller.show_error, cancel_previous=True)
+
+
+# Runs on a worker thread: waits for the comparison session to analyze every file
+def load_comparison(task, file_paths):
+    global comparison_session
+    import comparison
+
+    if comparison_session is None:
+        comparison_session = comparison.ComparisonSession(dtype=analysiscache.cache.dtype)
+    task.progress(0, f"Analyzing {len(file_paths)} files")
+    return comparison_session.load(file_paths, progress=lambda done, total, file_path: task.progress(done / total))
+
+
+# Runs on the main thread once load_comparison has finished
+def draw_comparison(summaries):
+    global compared_files
+    import guicontroller
+
+    compared_files = summaries
+    failed = [summary.name for summary in summaries if summary.error]
+    if failed:
+        guicontroller.status_label.config(text=f"Could not analyze {len(failed)} file(s): {', '.join(failed)}")
+    show_comparison()
+
+
+# Shows the current comparison view of the compared files
+def show_comparison():
+    import plotsurface
+
+    name = COMPARISON_VIEWS[current_comparison_view]
+    am.show_view(f"compare_{name}", plotsurface.COMPARE_VIEWS[name], compared_files)
+
+
+# Cycles through the spectrum, waveform and heatmap comparisons
+def swap_comparison_view():
+    global current_comparison_view
+    if not compared_files:
+        return
+    current_comparison_view = (current_comparison_view + 1) % len(COMPARISON_VIEWS)
+    show_comparison()
+
+
+# Updates the comparison buttons
+def update_compare_buttons():
+    import guicontroller
+    guicontroller.compare_button.config(command=compare_files)
+    guicontroller.compare_view_button.config(command=swap_comparison_view)
+
+
+# Exports the analysis of the selected file (spectrogram tiles, band peaks, metadata, see export.py)
+def export_selected():
+    import guicontroller
+    from tkinter import filedialog
+
+    file_path = guicontroller.selected_file_path
+    if not file_path or not os.path.exists(file_path):
+        return
+    output_path = filedialog.asksaveasfilename(defaultextension=".spx", filetypes=[("Analysis Export", "*.spx")],
+                                               initialfile=os.path.splitext(os.path.basename(file_path))[0] + ".spx")
+    if not output_path:
+        return
+    guicontroller.scheduler.submit('export', run_export, file_path, output_path,
+                                   on_done=show_export, on_error=guicontroller.show_error)
+
+
+# Runs on a worker thread: writes the export tile by tile
+def run_export(task, file_path, output_path):
+    import export
+
+    task.progress(None, "Loading audio")
+    analysis = analysiscache.get_analysis(file_path, task.progress)
+    task.progress(0, "Exporting analysis")
+    # The message is repeated since cancelling other work clears the status bar
+    return export.export_analysis(analysis, output_path,
+                                  progress=lambda fraction: task.progress(fraction, "Exporting analysis"))
+
+
+# Runs on the main thread once the export has been written
+def show_export(output_path):
+    import guicontroller
+    size = os.path.getsize(output_path) / 2**20
+    guicontroller.status_label.config(text=f"Exported to {os.path.basename(output_path)} ({size:.1f} MB)")
+
+
+# Updates the Export Analysis button
+def update_export_button():
+    import guicontroller
+    guicontroller.export_button.config(command=export_selected)
 
 
 # Updates the Combine Plots button
 def update_combine_button():
+    import guicontroller
     guicontroller.combine_plot_button.config(command=combine_plots)
 
 # Updates the other action button
 def update_other_button():
+    import guicontroller
     guicontroller.other_button.config(command=lambda: plot_specgram(guicontroller.selected_file_path))
 
 
-# Delays the updates slightly
-guicontroller.root.after(100, update_combine_button)
-guicontroller.root.after(100, update_other_button)
-
-# This is removed from the guicontroller and put here so it reads the visualization & AnalyticsModel modules before
-# trying to run the guicontroller file
-guicontroller.root.mainloop()
\ No newline at end of file
+# Starts the GUI, `--trace [file]` writes a timing trace of the session (like SPIDAM_TRACE)
+# and `--float32` analyzes in single precision (like SPIDAM_DTYPE=float32)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if "--trace" in argv:
+        position = argv.index("--trace")
+        file_path = argv[position + 1] if position + 1 < len(argv) else None
+        if file_path is not None and file_path.startswith("--"):
+            file_path = None
+        profiling.enable(file_path or profiling.default_trace_path())
+    if "--float32" in argv:
+        analysiscache.cache.dtype = np.dtype(np.float32)
+
+    import guicontroller
+    guicontroller.build_window()
+
+    # Delays the updates slightly
+    guicontroller.root.after(100, am.update_plot_button)
+    guicontroller.root.after(100, am.update_swap_button)
+    guicontroller.root.after(100, update_combine_button)
+    guicontroller.root.after(100, update_other_button)
+    guicontroller.root.after(100, update_compare_buttons)
+    guicontroller.root.after(100, update_export_button)
+
+    # This is removed from the guicontroller and put here so it reads the visualization & AnalyticsModel modules before
+    # trying to run the guicontroller file
+    guicontroller.root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
@@ -0,0 +1,226 @@
+### This file holds the WAV access layer. Instead of reading all frames into
+### memory it memory-maps the PCM data chunk, so even files larger than RAM can
+### be viewed and processed in chunks with bounded memory.
+
+import operator
+import os
+import struct
+import tempfile
+import wave
+import numpy as np
+
+# WAVE format codes
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Full scale of the samples handed to the analysis, that of 16-bit PCM whatever the file holds,
+# so the dB ranges of the plots fit every sample format
+FULL_SCALE = 32768
+
+# Frames converted at a time by MonoView and read per block by the streaming analysis (about 23 s at 44.1 kHz)
+DEFAULT_CHUNK_FRAMES = 1 << 20
+
+
+class WavFormatError(Exception):
+    pass
+
+
+# Sign-extends little-endian 24-bit samples given as (..., 3) bytes into int32
+def int24_to_int32(raw):
+    raw = np.asarray(raw, dtype=np.int32)
+    return (raw[..., 0] | (raw[..., 1] << 8) | (raw[..., 2] << 16)) << 8 >> 8
+
+
+# Converts a (frames, channels) block to signed mono samples at FULL_SCALE: 8-bit samples
+# are re-centred around zero and scaled up to int16, 24/32-bit samples become float32 and
+# float samples (full scale 1.0) are scaled up, then multiple channels are averaged
+def downmix(frames, sampwidth):
+    if frames.dtype.kind == 'f':
+        frames = frames * frames.dtype.type(FULL_SCALE)
+    elif sampwidth == 1:
+        frames = (frames.astype(np.int16) - 128) << 8
+    elif sampwidth > 2:
+        frames = frames.astype(np.float32) * np.float32(FULL_SCALE / 2 ** (8 * sampwidth - 1))
+    if frames.shape[1] == 1:
+        return frames[:, 0]
+    mono = frames.mean(axis=1)
+    if frames.dtype.kind == 'i':
+        mono = np.round(mono)
+    return mono.astype(frames.dtype)
+
+
+# Converts interleaved PCM bytes (whole frames) to signed mono samples
+def bytes_to_mono(data, n_channels, sampwidth, format_tag=WAVE_FORMAT_PCM):
+    frames = np.frombuffer(data, dtype=sample_dtype(format_tag, sampwidth))
+    if sampwidth == 3:
+        frames = int24_to_int32(frames.reshape(-1, n_channels, 3))
+    return downmix(frames.reshape(-1, n_channels), sampwidth)
+
+
+# An unlinked temporary file in SPIDAM_SCRATCH_DIR for samples that should not be held in memory,
+# None unless that variable is set, since nothing is written to disk without being asked for
+# The file disappears once it is closed and no mapping of it is left
+def scratch_file():
+    directory = os.environ.get("SPIDAM_SCRATCH_DIR")
+    return tempfile.TemporaryFile(prefix="spidam-", dir=directory) if directory else None
+
+
+# Writes 1D samples to a mono WAV file, used only when an export is explicitly requested
+def write_wav(file_path, samples, framerate):
+    samples = np.asarray(samples)
+    if samples.dtype.kind == 'f':
+        samples = np.clip(np.round(samples), -32768, 32767).astype('<i2')
+    with wave.open(file_path, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(samples.dtype.itemsize)
+        wav_file.setframerate(framerate)
+        wav_file.writeframes(np.ascontiguousarray(samples, dtype=samples.dtype.newbyteorder('<')).tobytes())
+
+
+# Returns the NumPy dtype used to store samples of the given format and width,
+# 24-bit samples have no NumPy dtype and are stored as 3 raw bytes
+def sample_dtype(format_tag, sampwidth):
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        if sampwidth == 4:
+            return np.dtype('<f4')
+        if sampwidth == 8:
+            return np.dtype('<f8')
+    elif format_tag == WAVE_FORMAT_PCM:
+        if sampwidth == 1:
+            return np.dtype('u1')  # 8-bit WAV samples are unsigned
+        if sampwidth == 2:
+            return np.dtype('<i2')
+        if sampwidth == 3:
+            return np.dtype('u1')
+        if sampwidth == 4:
+            return np.dtype('<i4')
+    raise WavFormatError(f"Unsupported WAV format {format_tag:#x} with {sampwidth * 8}-bit samples")
+
+
+# Memory-mapped view of a WAV file's sample data
+class WavReader:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._parse_header()
+
+        if self.n_frames == 0:
+            self._raw = np.zeros((0, self.n_channels), dtype=self.dtype)
+        elif self.sampwidth == 3:
+            self._raw = np.memmap(file_path, dtype=self.dtype, mode='r', offset=self.data_offset,
+                                  shape=(self.n_frames, self.n_channels, 3))
+        else:
+            self._raw = np.memmap(file_path, dtype=self.dtype, mode='r', offset=self.data_offset,
+                                  shape=(self.n_frames, self.n_channels))
+
+    # Walks the RIFF chunks to find the format description and the data chunk
+    def _parse_header(self):
+        file_size = os.path.getsize(self.file_path)
+        with open(self.file_path, 'rb') as f:
+            riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+            if riff != b'RIFF' or wave_id != b'WAVE':
+                raise WavFormatError(f"{self.file_path} is not a RIFF/WAVE file")
+
+            fmt = None
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    raise WavFormatError(f"{self.file_path} has no data chunk")
+                chunk_id, chunk_size = struct.unpack('<4sI', header)
+
+                if chunk_id == b'fmt ':
+                    fmt = f.read(chunk_size)
+                    if chunk_size % 2:
+                        f.seek(1, 1)
+                elif chunk_id == b'data':
+                    if fmt is None:
+                        raise WavFormatError(f"{self.file_path} has a data chunk before its fmt chunk")
+                    self.data_offset = f.tell()
+                    # Files still being written (or over 4 GB) can have a wrong size, trust the file length
+                    data_size = min(chunk_size, file_size - self.data_offset)
+                    break
+                else:
+                    f.seek(chunk_size + chunk_size % 2, 1)
+
+        format_tag, self.n_channels, self.framerate, _, self.block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+        if format_tag == WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            format_tag = struct.unpack('<H', fmt[24:26])[0]
+        self.format_tag = format_tag
+        self.sampwidth = (bits + 7) // 8
+        self.dtype = sample_dtype(format_tag, self.sampwidth)
+        self.n_frames = data_size // self.block_align
+        self.duration = self.n_frames / float(self.framerate)
+
+    # Returns frames [start, stop) as an array of shape (frames, channels)
+    # For 8/16/32-bit files this is a zero-copy view of the mapped file
+    def read(self, start=0, stop=None):
+        raw = self._raw[start:stop]
+        if self.sampwidth == 3:
+            return int24_to_int32(raw)
+        return raw
+
+    # Returns frames [start, stop) as signed mono samples at FULL_SCALE (see downmix)
+    # Mono 16-bit files give a zero-copy view, other files a MonoView that only
+    # converts the frames that are sliced from it, so a long recording is never
+    # converted as a whole and no mono copy of it is written anywhere
+    def mono(self, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.n_frames)
+        if self.n_channels == 1 and self.sampwidth == 2:
+            return self._raw[start:stop, 0]
+        return MonoView(self, start, max(start, stop))
+
+    def close(self):
+        # Dropping the reference releases the mapping once all views are gone
+        self._raw = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Read-only 1D sequence of the mono samples of a WavReader, downmixed (see downmix) when they
+# are read: a slice returns a new array of just those frames, np.asarray converts everything
+# The analysis reads it in chunks, like a memory-mapped mono file
+class MonoView:
+    ndim = 1
+
+    def __init__(self, reader, start, stop):
+        self._reader = reader
+        self._start = start
+        self.shape = (stop - start,)
+        self.dtype = downmix(reader.read(0, 0), reader.sampwidth).dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    # Converts frames [start, stop) of the view, chunk by chunk so long ranges need no large temporaries
+    def _convert(self, start, stop):
+        if stop - start <= DEFAULT_CHUNK_FRAMES:
+            return downmix(self._reader.read(self._start + start, self._start + stop), self._reader.sampwidth)
+        samples = np.empty(stop - start, dtype=self.dtype)
+        for chunk_start in range(start, stop, DEFAULT_CHUNK_FRAMES):
+            chunk_stop = min(chunk_start + DEFAULT_CHUNK_FRAMES, stop)
+            samples[chunk_start - start:chunk_stop - start] = self._convert(chunk_start, chunk_stop)
+        return samples
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            frames = range(*key.indices(len(self)))
+            if not frames:
+                return np.empty(0, dtype=self.dtype)
+            low, high = min(frames[0], frames[-1]), max(frames[0], frames[-1]) + 1
+            return self._convert(low, high)[frames.start - low::frames.step]
+        try:
+            index = operator.index(key)
+        except TypeError:
+            return np.asarray(self)[key]
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"index {index} is out of bounds for {len(self)} samples")
+        index %= len(self)
+        return self._convert(index, index + 1)[0]
+
+    def __array__(self, dtype=None, copy=None):
+        samples = self._convert(0, len(self))
+        return samples if dtype is None else samples.astype(dtype, copy=False)